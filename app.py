@@ -1,98 +1,63 @@
 import os
-import chromadb
 import streamlit as st
-import yaml
-from openai import OpenAI
 from dotenv import load_dotenv
+
+# Load environment variables (if any), before the imports below read their settings
+load_dotenv()
+
+from utils.config import load_libraries
+from service import ServiceThread, stream_chat_http, DEFAULT_MODEL
     
 ######################################################
 # Configuration
 ######################################################
 
-# Configure list of libraries
-with open("./utils/libraries.yaml", "r") as f:
-    data = yaml.safe_load(f)
-LIBRARY_LIST = sorted(list(data.keys()))
+# Configure list of libraries (parsed once, then read from a JSON copy until the YAML changes)
+LIBRARY_LIST = sorted(load_libraries())
+
+# Configure retrieval scopes, "Auto" lets the service guess from the question
+SEARCH_SCOPES = {
+    "Auto": None,
+    "All pages": {},
+    "API reference": {"doc_type": "api"},
+    "Guides and tutorials": {"doc_type": "guide"},
+    "Code examples": {"is_code": True}
+}
 
-# Configure ChromaDB client
-if "client" not in st.session_state:
-    st.session_state.client = chromadb.PersistentClient(path="./vectors")
+# Configure chat backend: a running service.py (e.g. http://localhost:8000), otherwise one in this process
+CHAT_API_URL = os.getenv("CHAT_API_URL")
 
 # Initialize session state variables
 if "openai_model" not in st.session_state:
-    st.session_state["openai_model"] = "gpt-4o-mini"
+    st.session_state["openai_model"] = DEFAULT_MODEL
 if "history" not in st.session_state:
     st.session_state.history = []
 if "library_name" not in st.session_state:
     st.session_state.library_name = LIBRARY_LIST[0]  # Default to first option
-
-# Load environment variables (if any)
-load_dotenv()
     
 ######################################################
 # Utility Functions
 ###################################################### 
 
-def prompt_expansion(query, library_name):
-    
-    response = OPENAI_CLIENT.chat.completions.create(
-        model=st.session_state["openai_model"],
-        messages=[
-            {"role": "system", "content": f"You are a knowledgeable developer in a Python library/tool called {library_name}. First, paraphrase the user query twice, then followed by answering in 2 short and concise sentences without any code."},
-            {"role": "user", "content": query}
-        ],
-    )
-    
-    ai_response = response.choices[0].message.content.strip()
+@st.cache_resource
+def get_service():
+    # One service per process, so every session shares the indexes and the OpenAI connection pool.
+    # Returns right away, the service loads in the background while the page renders.
+    return ServiceThread()
 
-    expanded_prompt = f"{query} {ai_response}"
-    
-    return expanded_prompt
-         
-def prompt_with_rag(query, library_name):
-    
-    try:
-        collection = st.session_state.client.get_collection(name=f"{library_name}_docs")
-    except Exception:
-        st.error(f"No data on {library_name}.")
-        st.stop()
-    
-    result = collection.query(
-        query_texts=[query],
-        include=["documents","metadatas"],
-        n_results = 4
-    )
-    
-    docs = result.get("documents", [])
-    if docs:
-        docs = docs[0]
-    context = "\n\n".join(docs) if docs else ""
-    
-    metas = result.get("metadatas", [])
-    metadata_list = metas[0] if metas else []
-
-    prompt = (
-        f"As a beginner-friendly coding assistant, use the following context to answer the question concisely and shortly. Provide short, simple and easy to understand Python code. Prevent using custom functions. "
-        f"For any code chunk, wrap it in triple backticks and specify the language after the opening backticks. For plain text, the triple backticks are not needed. \n\n"
-        f"Context:\n{context}\n\n"
-        f"Question: {query}\nAnswer:"
-    )
-    
-    print("---------------------------------------------------------")
-    # print(prompt)
-    return prompt, metadata_list    
+def chat_events(**request):
+    # Events of one chat turn: sources, tokens, done (or a single error)
+    if CHAT_API_URL:
+        return stream_chat_http(CHAT_API_URL, **request)
+    return get_service().stream_chat(**request)
 
-def prompt_without_rag(query):
-    
-    prompt = (
-        f"As a beginner-friendly coding assistant, answer the question concisely and shortly. Provide short, simple and easy to understand Python code. Prevent using custom functions. " 
-        f"For any code chunk, wrap it in triple backticks and specify the language after the opening backticks. For plain text, the triple backticks are not needed. \n\n"
-        f"Question: {query}\nAnswer:"
-    )
-    
-    print("---------------------------------------------------------")
-    # print(prompt)
-    return prompt 
+def stream_tokens(events, result):
+    # Yields the streamed text for st.write_stream and keeps the final event
+    for event in events:
+        if event["event"] == "token":
+            yield event["content"]
+        else:
+            result.update(event)
 
 ######################################################
 # App Layout
@@ -145,6 +110,12 @@ with st.sidebar:
         unsafe_allow_html=True
     )
 
+    st.session_state.search_scope = st.selectbox("Search in", options=list(SEARCH_SCOPES), key="scope_selector")
+
+# Load the selected library's index in the background, once per process
+if not CHAT_API_URL:
+    get_service().load_library(st.session_state.library_name)
+
 # Landing page 
 with st.container():
     OPENAI_KEY = os.getenv("OPENAI_KEY")
@@ -170,7 +141,6 @@ with st.container():
             unsafe_allow_html=True
         )
         st.stop()
-    OPENAI_CLIENT = OpenAI(api_key=OPENAI_KEY)
     
 # Chat messages
 for message in st.session_state.history:
@@ -184,46 +154,44 @@ if prompt := st.chat_input(placeholder=f"Ask about {st.session_state.library_nam
     
     with st.chat_message("user"):
         st.text(prompt)
-        
-    # Deliver prompt based on RAG toggle
-    if st.session_state.use_rag:
-        # Expand prompt for improved RAG
-        expanded_prompt = prompt_expansion(prompt, st.session_state.library_name)
-        print(expanded_prompt)
-        model_prompt, metadata_list = prompt_with_rag(expanded_prompt, st.session_state.library_name)
-    else:
-        model_prompt = prompt_without_rag(prompt)
-        metadata_list = []
+
+    # Retrieval, caching, prompt assembly and telemetry all happen in the service
+    events = chat_events(
+        query=prompt,
+        library_name=st.session_state.library_name,
+        history=st.session_state.history,
+        use_rag=st.session_state.use_rag,
+        api_key=OPENAI_KEY,
+        model=st.session_state["openai_model"],
+        filters=SEARCH_SCOPES[st.session_state.search_scope]
+    )
+    first = next(events, {"event": "error", "message": "No response from the chat service."})
+    if first["event"] == "error":
+        st.error(first["message"])
+        st.stop()
     
     st.session_state.history.append({"role": "user", "content": prompt})
         
     with st.chat_message("assistant"):
         
-        final_prompt = st.session_state.history.copy()
-        final_prompt[-1] = {"role": "user", "content": model_prompt}
-        
-        # The final prompt sent should contain
-        # 1. chat history without context and expansion
-        # 2. instructions + overall directions
-        # 3. user prompt (currently the expanded version, may change later, depends)
-        # print(final_prompt)
-        # print(st.session_state.history)
-
-        stream = OPENAI_CLIENT.chat.completions.create(
-            model=st.session_state["openai_model"],
-            messages=final_prompt,
-            stream=True,
-        )
-        response = st.write_stream(
-            part.choices[0].delta.content or ""
-            for part in stream
-            if part.choices[0].delta.content is not None
-        )
+        result = {}
+        response = st.write_stream(stream_tokens(events, result))
+        if result.get("event") == "error":
+            st.session_state.history.pop()
+            st.error(result["message"])
+            st.stop()
         
-        if metadata_list:
+        if first["sources"]:
             with st.expander("Sources"):
-                links = [m["url"] for m in metadata_list if "url" in m]
-                st.markdown("\n".join(f"- {link}" for link in links))
+                # Several chunks may come from the same page, link each section once
+                links = {}
+                for m in first["sources"]:
+                    if "url" in m:
+                        link = f"{m['url']}#{m['anchor']}" if m.get("anchor") else m["url"]
+                        # The heading trail starts at the page's h1, the title is the fallback
+                        label = m.get("section_path") or m.get("title")
+                        links.setdefault(link, label)
+                st.markdown("\n".join(f"- [{label}]({link})" if label else f"- {link}" for link, label in links.items()))
             
     # print(response)
     
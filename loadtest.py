@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from datetime import datetime
+import httpx
+import yaml
+from service import ChatService
+from utils.retrieval import rss_mb
+from utils import telemetry
+
+######################################################
+# Configuration
+######################################################
+
+QUESTIONS_PATH = "./utils/benchmark_questions.yaml"
+OUTPUT_DIR = "./logging/loadtest"
+MOCK_HOST = "127.0.0.1"
+
+parser = argparse.ArgumentParser(description="Ramp up concurrent chat sessions against a mock OpenAI server")
+parser.add_argument("--library", default="chroma", help="Library the sessions ask about")
+parser.add_argument("--ramp", default="1,5,10,25,50", help="Concurrent sessions per stage, comma separated")
+parser.add_argument("--stage-seconds", type=float, default=30, help="How long each stage keeps starting new turns")
+parser.add_argument("--turns", type=int, default=3, help="Turns per conversation before a session starts over")
+parser.add_argument("--think-time", type=float, default=1.0, help="Mean seconds a user waits between turns")
+parser.add_argument("--no-rag", action="store_true", help="Chat without retrieval")
+parser.add_argument("--cache", action="store_true", help="Keep the semantic cache on (replayed questions will hit it)")
+parser.add_argument("--url", help="Drive a running service.py over HTTP instead of an in-process ChatService")
+# Mock OpenAI-compatible server
+parser.add_argument("--mock-port", type=int, default=8799)
+parser.add_argument("--mock-only", action="store_true", help="Only run the mock server, e.g. for a service in a container")
+parser.add_argument("--latency", type=float, default=0.3, help="Seconds before the first streamed token")
+parser.add_argument("--token-rate", type=float, default=50, help="Streamed tokens per second per completion")
+parser.add_argument("--completion-tokens", type=int, default=150, help="Tokens per streamed answer")
+parser.add_argument("--expansion-latency", type=float, default=0.4, help="Seconds per (non-streamed) query expansion")
+parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls the mock fails with a 500 (the OpenAI client retries these twice)")
+parser.add_argument("--output", help="Results file (default: ./logging/loadtest/<timestamp>.json)")
+
+######################################################
+# Mock LLM
+######################################################
+
+def create_mock_llm(latency=0.3, token_rate=50, completion_tokens=150, expansion_latency=0.4, error_rate=0.0):
+
+    # Plain ASGI app that answers /v1/chat/completions like OpenAI does:
+    # JSON for normal calls (query expansion), SSE chunks for stream=True
+    words = "the collection stores documents with their embeddings and metadata for similarity search".split()
+
+    async def send_json(send, status, body):
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps(body).encode("utf-8")})
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        request = json.loads(body or b"{}")
+        if random.random() < error_rate:
+            await send_json(send, 500, {"error": {"message": "Mock failure", "type": "server_error"}})
+            return
+
+        chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": request.get("model", "mock")}
+        if not request.get("stream"):
+            await asyncio.sleep(expansion_latency)
+            content = "How do I use this feature? What is the way to do this in the library?"
+            await send_json(send, 200, {
+                **chunk,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            })
+            return
+
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+        await asyncio.sleep(latency)
+        for i in range(completion_tokens):
+            delta = {"index": 0, "delta": {"content": f"{words[i % len(words)]} "}, "finish_reason": None}
+            data = json.dumps({**chunk, "choices": [delta]})
+            await send({"type": "http.response.body", "body": f"data: {data}\n\n".encode("utf-8"), "more_body": True})
+            await asyncio.sleep(1 / token_rate)
+        done = json.dumps({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        await send({"type": "http.response.body", "body": f"data: {done}\n\ndata: [DONE]\n\n".encode("utf-8")})
+
+    return app
+
+def serve_mock(port, **settings):
+    import uvicorn
+    uvicorn.run(create_mock_llm(**settings), host=MOCK_HOST, port=port, log_level="warning")
+
+def start_mock(port, **settings):
+
+    # Separate process, so the mock's streaming doesn't compete with the service's event loop
+    process = multiprocessing.Process(target=serve_mock, args=(port,), kwargs=settings, daemon=True)
+    process.start()
+    for _ in range(50):
+        try:
+            httpx.get(f"http://{MOCK_HOST}:{port}/", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("Mock OpenAI server did not start")
+
+######################################################
+# Sessions
+######################################################
+
+async def http_events(client, url, **payload):
+
+    # Same events as ChatService.stream_chat, read from service.py over SSE
+    async with client.stream("POST", f"{url.rstrip('/')}/v1/chat", json=payload, headers={"X-OpenAI-Key": "loadtest"}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("data: "):
+                yield json.loads(line[len("data: "):])
+
+async def chat_turn(chat, query, library_name, history, use_rag):
+
+    # One user turn as the app sees it: time to first token, total time, tokens and outcome
+    start = time.perf_counter()
+    record = {"start": start, "ttft_ms": None, "tokens": 0, "error": ""}
+    parts = []
+    try:
+        async for event in chat(query=query, library_name=library_name, history=history, use_rag=use_rag):
+            if event["event"] == "token":
+                if record["ttft_ms"] is None:
+                    record["ttft_ms"] = (time.perf_counter() - start) * 1000
+                record["tokens"] += 1
+                parts.append(event["content"])
+            elif event["event"] == "error":
+                record["error"] = event["message"]
+    except Exception as e:
+        record["error"] = str(e) or type(e).__name__
+    record["total_ms"] = (time.perf_counter() - start) * 1000
+    return record, "".join(parts)
+
+async def session(chat, questions, library_name, args, deadline, records):
+
+    # A simulated user: asks a few questions in one conversation, thinks in between, starts over
+    history = []
+    while time.perf_counter() < deadline:
+        query = random.choice(questions)
+        record, answer = await chat_turn(chat, query, library_name, history, not args.no_rag)
+        records.append(record)
+        if record["error"]:
+            history = []
+        else:
+            history = (history + [{"role": "user", "content": query}, {"role": "assistant", "content": answer}])[-15:]
+        if len(history) >= args.turns * 2:
+            history = []
+        await asyncio.sleep(random.expovariate(1 / args.think_time) if args.think_time > 0 else 0)
+
+async def sample(stop, rss, lag):
+
+    # Peak memory of this process and event loop lag (how late a 50 ms sleep wakes up)
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.05)
+        lag.append((time.perf_counter() - start - 0.05) * 1000)
+        if (mb := rss_mb()) is not None:
+            rss.append(mb)
+
+def stage_report(sessions, records, seconds, rss, baseline_mb, lag, traces):
+    ok = [r for r in records if not r["error"]]
+    ttft = [r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]
+    total = [r["total_ms"] for r in ok]
+    spans = telemetry.summarize(traces)["spans"] if traces else {}
+    return {
+        "sessions": sessions,
+        "turns": len(records),
+        "errors": len(records) - len(ok),
+        "error_rate": round((len(records) - len(ok)) / len(records), 4) if records else 0.0,
+        "turns_per_sec": round(len(ok) / seconds, 2),
+        "tokens_per_sec": round(sum(r["tokens"] for r in ok) / seconds, 1),
+        "ttft_ms": {q: round(telemetry.percentile(ttft, int(q[1:])), 1) for q in ("p50", "p95", "p99")},
+        "turn_ms": {q: round(telemetry.percentile(total, int(q[1:])), 1) for q in ("p50", "p95", "p99")},
+        "loop_lag_ms_p95": round(telemetry.percentile(lag, 95), 1),
+        "peak_rss_mb": round(max(rss), 1) if rss else None,
+        "memory_per_session_mb": round((max(rss) - baseline_mb) / sessions, 2) if rss and baseline_mb else None,
+        # Where the time goes server side, to tell Chroma from the OpenAI stream as the bottleneck
+        "span_p95_ms": {name: s["p95_ms"] for name, s in spans.items()}
+    }
+
+async def run(args, questions):
+    stages = [int(n) for n in args.ramp.split(",")]
+    trace_path = os.path.join(OUTPUT_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-telemetry.jsonl")
+    report = {"created": str(datetime.now()), "config": vars(args), "stages": []}
+
+    if args.url:
+        client = httpx.AsyncClient(timeout=None, limits=httpx.Limits(max_connections=max(stages) * 2))
+        chat = lambda **request: http_events(client, args.url, **request)
+        service, baseline_mb = None, None
+    else:
+        # Same ChatService the app runs in-process, traces go to the load test's own file
+        telemetry.TELEMETRY_PATH = trace_path
+        service = ChatService(base_url=f"http://{MOCK_HOST}:{args.mock_port}/v1", use_cache=args.cache)
+        await asyncio.to_thread(service.warm_up)
+        chat = lambda **request: service.stream_chat(api_key="loadtest", **request)
+        # One turn to load the embedding model and connections before measuring
+        await chat_turn(chat, questions[0], args.library, [], not args.no_rag)
+        baseline_mb = rss_mb()
+
+    for sessions in stages:
+        logging.info(f"Stage: {sessions} concurrent sessions for {args.stage_seconds:.0f}s...")
+        records, rss, lag = [], [], []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample(stop, rss, lag))
+        since = str(datetime.now())
+        start = time.perf_counter()
+        deadline = start + args.stage_seconds
+        await asyncio.gather(*(session(chat, questions, args.library, args, deadline, records) for _ in range(sessions)))
+        # Turns still in flight at the deadline count towards this stage
+        seconds = time.perf_counter() - start
+        stop.set()
+        await sampler
+        traces = telemetry.load_traces(trace_path, since=since) if service else []
+        result = stage_report(sessions, records, seconds, rss, baseline_mb, lag, traces)
+        report["stages"].append(result)
+        logging.info(json.dumps(result))
+
+    if service:
+        await service.aclose()
+    else:
+        await client.aclose()
+    return report
+
+def print_report(report):
+    print(f"\n{'Sessions':>8}{'Turns/s':>9}{'Tok/s':>8}{'TTFT p50':>10}{'p95':>8}{'p99':>8}{'Errors':>8}{'MB/sess':>9}{'Lag p95':>9}")
+    for s in report["stages"]:
+        print(
+            f"{s['sessions']:>8}{s['turns_per_sec']:>9}{s['tokens_per_sec']:>8}{s['ttft_ms']['p50']:>10}"
+            f"{s['ttft_ms']['p95']:>8}{s['ttft_ms']['p99']:>8}{s['error_rate']:>8.1%}"
+            f"{s['memory_per_session_mb'] if s['memory_per_session_mb'] is not None else '-':>9}{s['loop_lag_ms_p95']:>9}"
+        )
+    # Size replicas by the last stage whose TTFT and errors are still acceptable
+    print("\nTurns/s flattening while TTFT grows means saturation; compare span_p95_ms in the results file")
+    print("(collection.query / lexical_search vs time_to_first_token) to see which side is the bottleneck.")
+
+######################################################
+# Main Execution
+######################################################
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("openai").setLevel(logging.WARNING)
+
+    mock_settings = {
+        "latency": args.latency,
+        "token_rate": args.token_rate,
+        "completion_tokens": args.completion_tokens,
+        "expansion_latency": args.expansion_latency,
+        "error_rate": args.error_rate
+    }
+    if args.mock_only:
+        logging.info(f"Mock OpenAI server on http://{MOCK_HOST}:{args.mock_port}/v1 (set OPENAI_BASE_URL to this)")
+        serve_mock(args.mock_port, **mock_settings)
+        exit()
+
+    with open(QUESTIONS_PATH) as f:
+        questions = [item["question"] for item in yaml.safe_load(f)[args.library]]
+
+    # A remote service talks to whatever OPENAI_BASE_URL it was started with (e.g. --mock-only)
+    mock = start_mock(args.mock_port, **mock_settings) if not args.url else None
+    try:
+        report = asyncio.run(run(args, questions))
+    finally:
+        if mock:
+            mock.terminate()
+
+    output = args.output or os.path.join(OUTPUT_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nResults saved to {output}")
@@ -0,0 +1,562 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import importlib
+import httpx
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Settings here and in utils/ (embeddings) are read at import time, so .env is loaded first.
+# app.py loads it too, before importing this module; existing environment variables win.
+load_dotenv()
+
+from utils.aliases import resolve_collection
+from utils.cache import SemanticCache
+from utils.embeddings import get_embedder
+from utils.exact import ExactIndex, open_index as open_exact_index
+from utils.lexical import search as lexical_search
+from utils.retrieval import (
+    expansion_messages, retrieve, hybrid_fusion, build_rag_prompt, build_plain_prompt, count_tokens,
+    count_message_tokens, select_passages, trim_history, warm_up_collections, classify_query
+)
+from utils.telemetry import Trace
+from utils.config import load_libraries
+
+######################################################
+# Configuration
+######################################################
+
+VECTOR_PATH = "./vectors"
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Configure the OpenAI connection pool, shared by every chat in the process
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # e.g. a local mock server for load tests
+MAX_CONNECTIONS = 100
+OPENAI_TIMEOUT = 60  # Seconds
+OPENAI_CLIENTS = 32  # Clients kept for caller-supplied keys, least recently used ones are dropped
+
+# Configure the HTTP endpoint (python service.py). Local only by default; when exposed (SERVICE_HOST=0.0.0.0),
+# callers from other hosts must send their own X-OpenAI-Key, the server's OPENAI_KEY is only used for local ones.
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8000"))
+
+# Configure startup: library indexes load the first time a library is used (or selected in the app).
+# "all" or a comma separated list loads those when the service starts instead.
+PRELOAD_LIBRARIES = os.getenv("PRELOAD_LIBRARIES", "")
+
+# Configure semantic cache for expansions and answers
+CACHE_THRESHOLD = 0.08  # Max cosine distance for a query to reuse a cached entry
+CACHE_TTL = 7 * 24 * 3600  # Seconds
+CACHE_MAX_ENTRIES = 2000
+
+# Configure retrieval
+N_RESULTS = 4  # Passages that go into the prompt at most
+CANDIDATE_RESULTS = 12  # Fused candidates considered before deduplication and reranking
+PARALLEL_RETRIEVAL = True  # Search the raw query while the expansion call is in flight
+SKIP_EXPANSION_DISTANCE = None  # If set, skip the expansion call when the best raw hit is this close (e.g. 0.5), checked before it is made
+VECTOR_WEIGHT = 1.0  # Weight of each vector result list in the fusion
+LEXICAL_WEIGHT = 1.0  # Weight of the BM25 result list, 0 disables lexical search
+ALIAS_TTL = 60  # Seconds before a library's live collection is resolved again
+ROUTE_QUERIES = True  # Scope searches by page type / version / code with classify_query when no filters are given
+MIN_FILTERED_HITS = N_RESULTS  # A filtered search returning fewer hits than this is rerun unfiltered
+
+# Configure the vector search engine: collections up to this many chunks are searched exactly with NumPy
+# (utils/exact.py, exported next to the index on first use), larger ones through HNSW; 0 always uses HNSW.
+# Exact search is faster below ~10k chunks and returns the true top-k; `python utils/benchmark.py --engines` compares them.
+EXACT_SEARCH_MAX_DOCS = int(os.getenv("EXACT_SEARCH_MAX_DOCS", "10000"))
+EXACT_SEARCH_DTYPE = "float32"  # float16/int8 halve/quarter memory and disk, scored block by block (slower, slightly lossy)
+
+# Configure context assembly
+REQUEST_TOKEN_BUDGET = 3500  # Whole request: history, instructions, context and question
+HISTORY_TOKEN_BUDGET = 1000  # Prior turns, older ones are folded into a short note
+RERANK = "mmr"  # "mmr", "cross-encoder" (needs sentence-transformers) or None
+MMR_LAMBDA = 0.7  # 1.0 ranks by relevance only, lower values favour diverse passages
+DEDUP_THRESHOLD = 0.8  # Word 3-gram overlap above which passages count as duplicates
+
+######################################################
+# Chat Service
+######################################################
+
+class ChatService:
+
+    # The RAG pipeline behind the chat, independent of Streamlit.
+    # Chroma, embedding and SQLite work runs in worker threads; OpenAI calls are async
+    # over one pooled HTTP client, so a single process can stream many chats at once.
+    # use_cache=False skips the semantic cache entirely (e.g. load tests replaying the same questions).
+    def __init__(self, vector_path=VECTOR_PATH, base_url=OPENAI_BASE_URL, max_connections=MAX_CONNECTIONS, use_cache=True):
+        # chromadb and openai are imported here rather than at module load, so importing
+        # this module (e.g. from app.py) stays cheap; see startup.py for the startup profile
+        import chromadb
+        start = time.perf_counter()
+        importlib.import_module("openai")  # Loaded here (in the background for the app), not on the first chat
+        self.libraries = sorted(load_libraries())
+        self.client = chromadb.PersistentClient(path=vector_path)
+        self.exact_path = os.path.join(vector_path, "exact")
+        self.embedder = get_embedder()
+        self.answer_cache = SemanticCache(
+            self.client,
+            threshold=CACHE_THRESHOLD,
+            ttl=CACHE_TTL,
+            max_entries=CACHE_MAX_ENTRIES,
+            embedder=self.embedder
+        ) if use_cache else None
+        self.base_url = base_url
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self._openai = OrderedDict()
+        self._collections = {}
+        self._collection_names = {}
+        self._indexes = {}
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        logging.info(f"Chat service ready in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    def openai(self, api_key):
+        # Clients are cheap wrappers, one per API key, all on the same connection pool.
+        # Only the OPENAI_CLIENTS most recent keys are kept, so callers' keys don't pile up in memory.
+        # Dropped clients are not closed, that would close the shared pool.
+        with self._lock:
+            if api_key in self._openai:
+                self._openai.move_to_end(api_key)
+                return self._openai[api_key]
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(api_key=api_key, base_url=self.base_url, http_client=self.http)
+        with self._lock:
+            self._openai[api_key] = client
+            while len(self._openai) > OPENAI_CLIENTS:
+                self._openai.popitem(last=False)
+        return client
+
+    def collection_name(self, library_name):
+        # Resolved through the alias file, so a rebuilt index goes live without a restart
+        name, resolved = self._collection_names.get(library_name, (None, 0))
+        if time.monotonic() - resolved > ALIAS_TTL:
+            name = resolve_collection(library_name)
+            self._collection_names[library_name] = (name, time.monotonic())
+        return name
+
+    def get_collection(self, collection_name):
+        # Keyed by the resolved name, so a swapped-in version gets its own handle
+        with self._lock:
+            if collection_name not in self._collections:
+                self._collections[collection_name] = self.client.get_collection(name=collection_name)
+            return self._collections[collection_name]
+
+    def search_index(self, collection_name):
+        # What vector search runs against: an ExactIndex for small collections, the Chroma collection
+        # otherwise. Checked again every ALIAS_TTL, so an export dropped by the scraper is rebuilt.
+        with self._index_lock:
+            index, checked = self._indexes.get(collection_name, (None, 0))
+            if index is None or time.monotonic() - checked > ALIAS_TTL:
+                collection = self.get_collection(collection_name)
+                if not (isinstance(index, ExactIndex) and index.is_current(collection)):
+                    try:
+                        index = open_exact_index(collection, EXACT_SEARCH_MAX_DOCS, EXACT_SEARCH_DTYPE, self.exact_path)
+                    except Exception as e:
+                        logging.warning(f"Exact search unavailable for '{collection_name}', using HNSW: {e}")
+                        index = None
+                    index = index or collection
+                self._indexes[collection_name] = (index, time.monotonic())
+            return index
+
+    def load_library(self, library_name):
+        # Loads a library's index (and the embedding model, the first time) once per collection version
+        name = self.collection_name(library_name)
+        if name not in self._loaded:
+            report = warm_up_collections(self.search_index, [name], embedder=self.embedder)
+            self._loaded[name] = report[0] if report else None
+        return self._loaded[name]
+
+    def warm_up(self, libraries=None):
+        libraries = self.libraries if libraries is None else libraries
+        return [r for r in (self.load_library(library) for library in libraries) if r]
+
+    async def prompt_expansion(self, openai, query, library_name, model):
+        response = await openai.chat.completions.create(
+            model=model,
+            messages=expansion_messages(query, library_name),
+        )
+        return f"{query} {response.choices[0].message.content.strip()}"
+
+    async def prompt_with_rag(self, openai, query, library_name, model, trace, expanded_prompt=None,
+                              token_budget=REQUEST_TOKEN_BUDGET, filters=None):
+        try:
+            with trace.span("get_collection"):
+                collection = await asyncio.to_thread(self.search_index, self.collection_name(library_name))
+        except Exception:
+            raise LookupError(f"No data on {library_name}.")
+        trace.attributes["engine"] = "exact" if isinstance(collection, ExactIndex) else "hnsw"
+
+        # Explicit filters (a Chroma `where`, {} for none) win over the routing guess
+        where = filters if filters is not None else (classify_query(query) if ROUTE_QUERIES else None)
+        trace.attributes["filter"] = json.dumps(where) if where else ""
+
+        async def expand(q):
+            # Awaited on the event loop, retrieve() only sends the searches to worker threads
+            with trace.span("prompt_expansion") as span:
+                expanded = await self.prompt_expansion(openai, q, library_name, model)
+                span["prompt_tokens"] = count_tokens(q)
+                span["completion_tokens"] = count_tokens(expanded) - span["prompt_tokens"]
+            return expanded
+
+        vector_hits, expanded_prompt = await retrieve(
+            collection,
+            query,
+            expand,
+            expanded_prompt,
+            n_results=CANDIDATE_RESULTS,
+            parallel=PARALLEL_RETRIEVAL,
+            skip_distance=SKIP_EXPANSION_DISTANCE,
+            span=trace.span,
+            embedder=self.embedder,
+            where=where,
+            min_filtered_hits=MIN_FILTERED_HITS
+        )
+
+        def assemble():
+            # Exact identifiers live in the raw query, so that's what goes to BM25
+            with trace.span("lexical_search", filtered=bool(where)) as span:
+                lexical_hits = []
+                if LEXICAL_WEIGHT > 0:
+                    lexical_hits = lexical_search(collection.name, query, CANDIDATE_RESULTS, where=where)
+                    if where and len(lexical_hits) < MIN_FILTERED_HITS:
+                        span["filtered"] = "fallback"
+                        lexical_hits = lexical_search(collection.name, query, CANDIDATE_RESULTS)
+
+            with trace.span("prompt_assembly") as span:
+                candidates = hybrid_fusion(vector_hits, lexical_hits, CANDIDATE_RESULTS, VECTOR_WEIGHT, LEXICAL_WEIGHT)
+                # Whatever the instructions and question leave of the budget goes to passages
+                context_budget = token_budget - count_tokens(build_rag_prompt(expanded_prompt, []))
+                hits = select_passages(
+                    query,
+                    candidates,
+                    context_budget,
+                    max_passages=N_RESULTS,
+                    rerank=RERANK,
+                    embedder=self.embedder,
+                    mmr_lambda=MMR_LAMBDA,
+                    dedup_threshold=DEDUP_THRESHOLD
+                )
+                span["candidates"] = len(candidates)
+                span["passages"] = len(hits)
+                prompt = build_rag_prompt(expanded_prompt, [h["document"] for h in hits])
+                span["prompt_tokens"] = count_tokens(prompt)
+            return prompt, [h["metadata"] for h in hits]
+
+        prompt, metadata_list = await asyncio.to_thread(assemble)
+        logging.debug(f"Expanded prompt: {expanded_prompt}")
+        return prompt, metadata_list, expanded_prompt
+
+    def prompt_without_rag(self, query):
+        return build_plain_prompt(query)
+
+    async def stream_chat(self, query, library_name, history=(), use_rag=True, api_key=None, model=DEFAULT_MODEL,
+                          filters=None):
+
+        # One chat turn as a stream of events:
+        # {"event": "sources"}, then {"event": "token"} per streamed chunk, then {"event": "done"}.
+        # Errors come as {"event": "error"} instead: alone before streaming starts, after the tokens mid-stream.
+        # `filters` scopes retrieval with a Chroma `where` ({} searches everything), None routes automatically.
+        trace = Trace("chat", library=library_name, use_rag=use_rag)
+        openai = self.openai(api_key or os.getenv("OPENAI_KEY"))
+        history = list(history)
+
+        # Cached answers only apply to the first turn, later turns depend on the chat history.
+        # Answers scoped by explicit filters aren't cached, the cache key doesn't include them.
+        # Entries are per model and per collection version, answers from a replaced version aren't served.
+        first_turn = not history and filters is None
+        cache_scope = {"model": model, "collection_name": self.collection_name(library_name) if use_rag else ""}
+        cached = None
+        if self.answer_cache is not None:
+            with trace.span("cache_lookup") as span:
+                cached = await asyncio.to_thread(self.answer_cache.lookup, query, library_name, use_rag, **cache_scope)
+                span["cache"] = "hit" if cached else "miss"
+
+        if cached and cached["answer"] and first_turn:
+            yield {"event": "sources", "sources": cached["sources"]}
+            yield {"event": "token", "content": cached["answer"]}
+            trace.finish(cache="hit")
+            yield {"event": "done", "answer": cached["answer"], "cache": "hit"}
+            return
+
+        # Prior turns get their own share of the budget, the rest is left for the RAG prompt
+        history = trim_history(history, HISTORY_TOKEN_BUDGET)
+        expanded_prompt = ""
+        try:
+            if use_rag:
+                # Expand prompt for improved RAG, reusing a cached expansion if there is one
+                model_prompt, metadata_list, expanded_prompt = await self.prompt_with_rag(
+                    openai,
+                    query,
+                    library_name,
+                    model,
+                    trace,
+                    cached["expansion"] if cached else None,
+                    token_budget=REQUEST_TOKEN_BUDGET - count_message_tokens(history) - 4,
+                    filters=filters
+                )
+            else:
+                model_prompt, metadata_list = self.prompt_without_rag(query), []
+        except Exception as e:
+            trace.finish(cache="error", error=str(e))
+            yield {"event": "error", "message": str(e)}
+            return
+
+        sources = [{k: m[k] for k in ("url", "anchor", "title", "section_path") if k in m} for m in metadata_list]
+        yield {"event": "sources", "sources": sources}
+
+        # The final prompt sent should contain
+        # 1. chat history without context and expansion, trimmed to HISTORY_TOKEN_BUDGET
+        # 2. instructions + overall directions
+        # 3. user prompt (currently the expanded version, may change later, depends)
+        final_prompt = history + [{"role": "user", "content": model_prompt}]
+        stream_start = trace.mark()
+        try:
+            stream = await openai.chat.completions.create(model=model, messages=final_prompt, stream=True)
+        except Exception as e:
+            trace.finish(cache="error", error=str(e))
+            yield {"event": "error", "message": str(e)}
+            return
+        parts = []
+        try:
+            async for part in stream:
+                content = part.choices[0].delta.content if part.choices else None
+                if content is None:
+                    continue
+                if not parts:
+                    trace.add_span("time_to_first_token", stream_start, trace.mark())
+                parts.append(content)
+                yield {"event": "token", "content": content}
+        except Exception as e:
+            # Upstream failed mid-stream (API error, dropped connection), nothing is cached
+            trace.finish(cache="error", error=str(e))
+            yield {"event": "error", "message": f"The answer was interrupted: {e}"}
+            return
+        finally:
+            # Also runs when the client goes away mid-stream, which closes the upstream request
+            await stream.close()
+        response = "".join(parts)
+        trace.add_span(
+            "completion_stream",
+            stream_start,
+            trace.mark(),
+            prompt_tokens=count_message_tokens(final_prompt),
+            completion_tokens=count_tokens(response)
+        )
+
+        if self.answer_cache is not None:
+            await asyncio.to_thread(
+                self.answer_cache.put,
+                query,
+                library_name,
+                use_rag,
+                expansion=expanded_prompt,
+                answer=response if first_turn else "",
+                sources=sources,
+                **cache_scope
+            )
+        cache = "expansion" if cached else "miss"
+        trace.finish(cache=cache)
+        yield {"event": "done", "answer": response, "cache": cache}
+
+def preload_libraries(libraries):
+    if PRELOAD_LIBRARIES == "all":
+        return libraries
+    return [name.strip() for name in PRELOAD_LIBRARIES.split(",") if name.strip() in libraries]
+
+class ServiceThread:
+
+    # Runs a ChatService on its own event loop thread, for synchronous callers like Streamlit.
+    # The service is built in the background, so the caller can render while the imports,
+    # the store and the embedding model load; the first call that needs it waits.
+    def __init__(self, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="chat-service", daemon=True).start()
+        self._service = asyncio.run_coroutine_threadsafe(asyncio.to_thread(ChatService, **kwargs), self.loop)
+        self._loads = {}
+        if PRELOAD_LIBRARIES:
+            self._service.add_done_callback(self._preload)
+
+    def _preload(self, future):
+        if not future.exception():
+            for library_name in preload_libraries(future.result().libraries):
+                self.load_library(library_name)
+
+    @property
+    def service(self):
+        return self._service.result()
+
+    def load_library(self, library_name):
+        # Starts loading a library's index in the background, at most once, and returns the future
+        if library_name not in self._loads:
+            async def load():
+                service = await asyncio.wrap_future(self._service)
+                return await asyncio.to_thread(service.load_library, library_name)
+            self._loads[library_name] = asyncio.run_coroutine_threadsafe(load(), self.loop)
+        return self._loads[library_name]
+
+    def stream_chat(self, **kwargs):
+        events = self.service.stream_chat(**kwargs)
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(events.__anext__(), self.loop).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            asyncio.run_coroutine_threadsafe(events.aclose(), self.loop).result()
+
+def stream_chat_http(api_url, **payload):
+
+    # Same events as ChatService.stream_chat, read from a running service over SSE.
+    # Like the in-process path, failures (bad key, 5xx, service down) come back as an error event.
+    api_key = payload.pop("api_key", None)
+    headers = {"X-OpenAI-Key": api_key} if api_key else {}
+    try:
+        with httpx.stream("POST", f"{api_url.rstrip('/')}/v1/chat", json=payload, headers=headers, timeout=None) as response:
+            if response.is_error:
+                response.read()
+                try:
+                    message = response.json().get("error")
+                except ValueError:
+                    message = None
+                yield {"event": "error", "message": message or f"Chat service returned {response.status_code}"}
+                return
+            for line in response.iter_lines():
+                if line.startswith("data: "):
+                    yield json.loads(line[len("data: "):])
+    except httpx.HTTPError as e:
+        logging.warning(f"Chat service request failed: {e}")
+        yield {"event": "error", "message": f"Chat service unavailable: {e}"}
+
+######################################################
+# HTTP Endpoint
+######################################################
+
+# Plain ASGI app served by uvicorn:
+#   GET  /health         liveness check
+#   GET  /v1/libraries   libraries that can be queried
+#   GET  /v1/stats       semantic cache and query embedding cache counters
+#   POST /v1/chat        {"query", "library_name", "history", "use_rag", "model", "filters"} -> text/event-stream
+# The OpenAI key comes from the X-OpenAI-Key header, or OPENAI_KEY on the server for local callers only.
+LOCAL_CLIENTS = ("127.0.0.1", "::1", "localhost")
+
+async def _send_json(send, status, body):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": json.dumps(body).encode("utf-8")})
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def _stream_events(service, payload, api_key, receive, send):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")]
+    })
+
+    # Stop generating (and release the upstream stream) as soon as the client disconnects
+    disconnected = asyncio.Event()
+
+    async def watch():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    watcher = asyncio.create_task(watch())
+    events = service.stream_chat(
+        payload["query"],
+        payload["library_name"],
+        history=payload.get("history", []),
+        use_rag=payload.get("use_rag", True),
+        api_key=api_key,
+        model=payload.get("model", DEFAULT_MODEL),
+        filters=payload.get("filters")
+    )
+    try:
+        async for event in events:
+            if disconnected.is_set():
+                break
+            data = f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            await send({"type": "http.response.body", "body": data.encode("utf-8"), "more_body": True})
+    except Exception as e:
+        logging.warning(f"Chat stream failed: {e}")
+        error = {"event": "error", "message": str(e)}
+        data = f"event: error\ndata: {json.dumps(error)}\n\n"
+        await send({"type": "http.response.body", "body": data.encode("utf-8"), "more_body": True})
+    finally:
+        await events.aclose()
+        watcher.cancel()
+    await send({"type": "http.response.body", "body": b""})
+
+def create_app(**kwargs):
+    state = {}
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    state["service"] = await asyncio.to_thread(ChatService, **kwargs)
+                    if PRELOAD_LIBRARIES:
+                        await asyncio.to_thread(state["service"].warm_up, preload_libraries(state["service"].libraries))
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await state["service"].aclose()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["type"] != "http":
+            return
+        service = state["service"]
+        route = (scope["method"], scope["path"])
+        if route == ("GET", "/health"):
+            await _send_json(send, 200, {"status": "ok"})
+        elif route == ("GET", "/v1/libraries"):
+            await _send_json(send, 200, {"libraries": service.libraries})
+        elif route == ("GET", "/v1/stats"):
+            await _send_json(send, 200, {"answer_cache": service.answer_cache.stats if service.answer_cache else None, "query_embeddings": service.embedder.stats})
+        elif route == ("POST", "/v1/chat"):
+            try:
+                payload = json.loads(await _read_body(receive))
+                if payload.get("library_name") not in service.libraries or not payload.get("query"):
+                    raise ValueError("Expected a query and a known library")
+            except ValueError as e:
+                await _send_json(send, 400, {"error": str(e)})
+                return
+            headers = dict(scope["headers"])
+            api_key = headers.get(b"x-openai-key", b"").decode() or None
+            if api_key is None and (scope.get("client") or ("",))[0] not in LOCAL_CLIENTS:
+                # Remote callers can't spend the operator's key
+                await _send_json(send, 401, {"error": "Missing X-OpenAI-Key header"})
+                return
+            await _stream_events(service, payload, api_key, receive, send)
+        else:
+            await _send_json(send, 404, {"error": "Not found"})
+
+    return app
+
+app = create_app()
+
+######################################################
+# Main Execution
+######################################################
+
+if __name__ == "__main__":
+    import uvicorn
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+    uvicorn.run("service:app", host=SERVICE_HOST, port=SERVICE_PORT)
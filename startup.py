@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+######################################################
+# Configuration
+######################################################
+
+# Startup budget (ms) for a cold process, from interpreter start to the first streamed token.
+# Streamlit's own server start comes on top. `python startup.py --check` fails when a phase is over.
+STARTUP_BUDGET_MS = {
+    "imports": 1500,  # What app.py imports at the top of every script run
+    "config": 100,  # libraries.yaml, from its parsed JSON copy
+    "service": 3000,  # chromadb, the persistent store and the semantic cache collection
+    "library": 4000,  # First library index and the embedding model
+    "first_token": 1500,  # Retrieval and prompt assembly for the first question (mock LLM)
+    "total": 10000
+}
+MOCK_PORT = 8798
+
+parser = argparse.ArgumentParser(description="Measure cold start of the chat app against STARTUP_BUDGET_MS")
+parser.add_argument("--library", default="chroma", help="Library loaded and asked about")
+parser.add_argument("--runs", type=int, default=1, help="Cold starts to measure, the slowest one is reported")
+parser.add_argument("--profile", action="store_true", help="Also list the slowest imports (python -X importtime)")
+parser.add_argument("--check", action="store_true", help="Exit with an error when over budget")
+parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+
+######################################################
+# Cold Start
+######################################################
+
+def measure_child(library_name):
+
+    # Runs in a fresh interpreter; nothing from the app is imported before the clock starts
+    phases = {}
+    start = time.perf_counter()
+
+    def phase(name, since):
+        phases[name] = round((time.perf_counter() - since) * 1000, 1)
+        return time.perf_counter()
+
+    from utils.config import load_libraries
+    from service import ChatService
+    mark = phase("imports", start)
+    from utils import telemetry
+    telemetry.TELEMETRY_PATH = os.devnull  # Keep the measurement out of the request stats
+    libraries = load_libraries()
+    if library_name not in libraries:
+        raise ValueError(f"Unknown library: {library_name}")
+    mark = phase("config", mark)
+    service = ChatService(base_url=f"http://127.0.0.1:{MOCK_PORT}/v1", use_cache=False)
+    # Exact search exports go to a scratch directory, so a check leaves nothing behind in vectors/
+    # (e.g. in an image build); it also measures a first start that has to export
+    service.exact_path = tempfile.mkdtemp(prefix="startup-exact-")
+    mark = phase("service", mark)
+    service.load_library(library_name)
+    mark = phase("library", mark)
+
+    async def first_token():
+        async for event in service.stream_chat("How do I get started?", library_name, api_key="startup"):
+            if event["event"] in ("token", "error"):
+                return event
+        return {"event": "error", "message": "No tokens streamed"}
+
+    event = asyncio.run(first_token())
+    phase("first_token", mark)
+    shutil.rmtree(service.exact_path, ignore_errors=True)
+    if event["event"] == "error":
+        raise RuntimeError(event["message"])
+    print(json.dumps(phases))
+
+def cold_start(library_name, profile=False):
+    command = [sys.executable] + (["-X", "importtime"] if profile else []) + [__file__, "--child", "--library", library_name]
+    start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True, env={**os.environ, "ANONYMIZED_TELEMETRY": "False"})
+    wall_ms = round((time.perf_counter() - start) * 1000, 1)
+    if result.returncode != 0:
+        raise RuntimeError(f"Cold start failed:\n{result.stderr[-2000:]}")
+    phases = json.loads(result.stdout.strip().splitlines()[-1])
+    # Interpreter start and everything before the first token, as the process experienced it
+    phases["total"] = wall_ms
+    return phases, result.stderr if profile else ""
+
+def slowest_imports(importtime_log, top=15):
+
+    # "import time: self [us] | cumulative | imported package" lines from -X importtime
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative), int(own), name))
+    top_level = sorted((r for r in rows if "." not in r[2]), reverse=True)[:top]
+    return [{"module": name, "cumulative_ms": round(c / 1000, 1), "self_ms": round(s / 1000, 1)} for c, s, name in top_level]
+
+######################################################
+# Main Execution
+######################################################
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.child:
+        measure_child(args.library)
+        exit()
+
+    from loadtest import start_mock
+    mock = start_mock(MOCK_PORT, latency=0, token_rate=1000, completion_tokens=5, expansion_latency=0)
+    try:
+        runs = [cold_start(args.library, args.profile) for _ in range(args.runs)]
+    finally:
+        mock.terminate()
+
+    phases = {name: max(run[name] for run, _ in runs) for name in STARTUP_BUDGET_MS}
+    over = [name for name, ms in phases.items() if ms > STARTUP_BUDGET_MS[name]]
+    print(f"\n{'Phase':<14}{'ms':>10}{'Budget':>10}")
+    for name, ms in phases.items():
+        print(f"{name:<14}{ms:>10}{STARTUP_BUDGET_MS[name]:>10}{'  OVER' if name in over else ''}")
+
+    if args.profile:
+        print(f"\n{'Import':<28}{'Cumulative ms':>15}{'Self ms':>10}")
+        for row in slowest_imports(runs[-1][1]):
+            print(f"{row['module']:<28}{row['cumulative_ms']:>15}{row['self_ms']:>10}")
+
+    if args.check and over:
+        print(f"\nStartup over budget: {', '.join(over)}")
+        exit(1)
@@ -0,0 +1,91 @@
+import os
+import re
+import json
+import logging
+
+########################################################
+# Configuration
+########################################################
+
+VECTOR_PATH = "./vectors"
+ALIAS_FILE = "aliases.json"
+PREVIOUS_KEY = "__previous__"  # {library: collection that was live before the current one}, the rollback target
+
+########################################################
+# Utility Functions
+########################################################
+
+# Each library is built into a versioned collection ({library}_docs__v{n}),
+# and aliases.json points every library at the version that is live.
+# Libraries without an alias fall back to the legacy {library}_docs collection.
+
+def _alias_path(path):
+    return os.path.join(path, ALIAS_FILE)
+
+def _read_aliases(path):
+    try:
+        with open(_alias_path(path), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def load_aliases(path=VECTOR_PATH):
+    return {library: name for library, name in _read_aliases(path).items() if library != PREVIOUS_KEY}
+
+def resolve_collection(library_name, path=VECTOR_PATH):
+    return load_aliases(path).get(library_name, f"{library_name}_docs")
+
+def previous_collection(library_name, path=VECTOR_PATH):
+    return _read_aliases(path).get(PREVIOUS_KEY, {}).get(library_name)
+
+def promote_collection(library_name, collection_name, path=VECTOR_PATH):
+
+    # The version being replaced is recorded as the previous one, so pruning keeps it for rollback.
+    # Write to a temp file and rename so readers never see a partial file
+    aliases = _read_aliases(path)
+    current = aliases.get(library_name, f"{library_name}_docs")
+    if current != collection_name:
+        aliases.setdefault(PREVIOUS_KEY, {})[library_name] = current
+    aliases[library_name] = collection_name
+    tmp_path = _alias_path(path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(aliases, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, _alias_path(path))
+    logging.info(f"'{library_name}' now points to '{collection_name}'")
+
+def list_versions(CLIENT, library_name):
+
+    # Returns [(version, collection_name)] sorted by version, legacy collection is version 0
+    pattern = re.compile(rf"^{re.escape(library_name)}_docs(?:__v(\d+))?$")
+    versions = []
+    for c in CLIENT.list_collections():
+        match = pattern.match(c.name)
+        if match:
+            versions.append((int(match.group(1) or 0), c.name))
+    return sorted(versions)
+
+def next_version_name(CLIENT, library_name):
+    versions = list_versions(CLIENT, library_name)
+    latest = versions[-1][0] if versions else 0
+    return f"{library_name}_docs__v{latest + 1}"
+
+def prune_versions(CLIENT, library_name, keep=1, path=VECTOR_PATH):
+
+    # Delete versions older than the live one, keeping `keep` of them for rollback and so that app
+    # instances with a cached pointer keep working until they re-resolve: the previously live version
+    # first, then the newest. Versions newer than the live one are staging builds (running, or
+    # abandoned and left for monitor.py), never pruned.
+    active = resolve_collection(library_name, path)
+    versions = list_versions(CLIENT, library_name)
+    live = next((version for version, name in versions if name == active), None)
+    if live is None:
+        logging.warning(f"Live collection '{active}' of '{library_name}' not found, nothing pruned")
+        return []
+    older = [name for version, name in versions if version < live]
+    previous = previous_collection(library_name, path)
+    kept = ([previous] if previous in older else []) + [name for name in reversed(older) if name != previous]
+    stale = [name for name in older if name not in kept[:keep]]
+    for name in stale:
+        CLIENT.delete_collection(name=name)
+        logging.info(f"Deleted old collection '{name}'")
+    return stale
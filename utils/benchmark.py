@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import time
+import yaml
+import asyncio
+import argparse
+import tempfile
+import chromadb
+import numpy as np
+from types import SimpleNamespace
+from datetime import datetime
+from telemetry import percentile
+from exact import ExactIndex, export_collection
+
+# Questions go through the service's own retrieval (service.py, in the repo root)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import service
+
+########################################################
+# Configuration
+########################################################
+
+VECTOR_PATH = "./vectors"
+QUESTIONS_PATH = "./utils/benchmark_questions.yaml"
+OUTPUT_DIR = "./logging/benchmark"
+
+parser = argparse.ArgumentParser(description="Offline retrieval benchmark over ./vectors")
+parser.add_argument("--library", action="append", help="Library to benchmark, repeatable (default: all in the question set)")
+parser.add_argument("--runs", type=int, default=3, help="Times each question is replayed")
+parser.add_argument("--n-results", type=int, default=4, help="Passages that go into the prompt")
+parser.add_argument("--candidates", type=int, default=12, help="Fused candidates before deduplication and reranking")
+parser.add_argument("--token-budget", type=int, default=3500, help="Token budget of the RAG prompt")
+parser.add_argument("--rerank", choices=["mmr", "cross-encoder", "none"], default="mmr")
+parser.add_argument("--no-expansion", action="store_true", help="Search with the raw query only")
+parser.add_argument("--no-routing", action="store_true", help="Don't scope searches with classify_query")
+parser.add_argument("--serial", action="store_true", help="Disable the parallel raw-query search")
+parser.add_argument("--skip-distance", type=float, default=None)
+parser.add_argument("--vector-weight", type=float, default=1.0)
+parser.add_argument("--lexical-weight", type=float, default=1.0)
+parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM waits per call")
+parser.add_argument("--engine", choices=["auto", "hnsw", "exact"], default="auto",
+                    help="Vector search engine, auto picks by size like the service (exact exports the collection first)")
+parser.add_argument("--engines", action="store_true", help="Compare HNSW and exact search on synthetic collections instead")
+parser.add_argument("--engine-sizes", default="1000,5000,20000,50000", help="Collection sizes for --engines")
+parser.add_argument("--output", help="Results file (default: ./logging/benchmark/<timestamp>.json)")
+parser.add_argument("--compare", help="Previous results file to print deltas against")
+
+########################################################
+# Utility Functions
+########################################################
+
+class StubOpenAI:
+
+    # Stands in for the async OpenAI client: returns a fixed paraphrase after a fixed delay
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model, messages, **kwargs):
+        await asyncio.sleep(self.latency)
+        query = messages[-1]["content"]
+        content = f"How to {query.rstrip('?')}? What is the way to {query.rstrip('?')}?"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def _normalize(url):
+    return url.split("#")[0].rstrip("/")
+
+def configure_service(args):
+
+    # The benchmark's settings, applied to the service module the way its own constants are set
+    service.N_RESULTS = args.n_results
+    service.CANDIDATE_RESULTS = args.candidates
+    service.RERANK = None if args.rerank == "none" else args.rerank
+    service.PARALLEL_RETRIEVAL = not args.serial
+    service.SKIP_EXPANSION_DISTANCE = args.skip_distance
+    service.VECTOR_WEIGHT = args.vector_weight
+    service.LEXICAL_WEIGHT = args.lexical_weight
+    service.ROUTE_QUERIES = not args.no_routing
+    if args.engine != "auto":
+        # Exact whatever the size (an empty collection gets an empty export), or never
+        service.EXACT_SEARCH_MAX_DOCS = sys.maxsize if args.engine == "exact" else 0
+
+async def run_library(chat_service, library_name, questions, args, stub):
+
+    # Each question runs through ChatService.prompt_with_rag, as a chat would: routing and its
+    # unfiltered fallback, expansion, hybrid search, fusion, reranking and prompt assembly
+    latencies, recalls, hits_any, prompt_tokens = [], [], [], []
+    engines = set()
+
+    for item in questions:
+        expected = {_normalize(u) for u in item["sources"]}
+        for _ in range(args.runs):
+            trace = service.Trace("benchmark", library=library_name)
+            start = time.perf_counter()
+            prompt, metadata_list, _ = await chat_service.prompt_with_rag(
+                stub, item["question"], library_name, "stub", trace,
+                # An "expansion" equal to the query is searched once, without an expansion call
+                expanded_prompt=item["question"] if args.no_expansion else None,
+                token_budget=args.token_budget
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+            engines.add(trace.attributes["engine"])
+
+            prompt_tokens.append(service.count_tokens(prompt))
+            found = {_normalize(m.get("url", "")) for m in metadata_list}
+            recalls.append(len(expected & found) / len(expected))
+            hits_any.append(1.0 if expected & found else 0.0)
+
+    index = chat_service.search_index(chat_service.collection_name(library_name))
+    return {
+        "collection": index.name,
+        "engine": "/".join(sorted(engines)),
+        "documents": index.count(),
+        "questions": len(questions),
+        "samples": len(latencies),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2)
+        },
+        f"recall@{args.n_results}": round(sum(recalls) / len(recalls), 4),
+        f"hit_rate@{args.n_results}": round(sum(hits_any) / len(hits_any), 4),
+        "prompt_tokens": {
+            "mean": round(sum(prompt_tokens) / len(prompt_tokens), 1),
+            "p95": percentile(prompt_tokens, 95)
+        }
+    }
+
+def engine_benchmark(sizes, dim=384, n_queries=100, k=12, clusters=64):
+
+    # HNSW vs exact search over synthetic clustered vectors: latency of one batched query
+    # (raw + expanded, as retrieve() sends them) and how much of the exact top-k HNSW returns
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    client = chromadb.EphemeralClient()
+    include = ["documents", "metadatas", "distances", "embeddings"]
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        for size in sizes:
+            vectors = centers[rng.integers(clusters, size=size)] + rng.normal(0, 0.5, (size, dim)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            collection = client.create_collection(f"engines_{size}", configuration={"hnsw": {"space": "cosine"}})
+            for start in range(0, size, 5000):
+                rows = range(start, min(start + 5000, size))
+                collection.add(
+                    ids=[str(i) for i in rows],
+                    embeddings=vectors[start:start + len(rows)],
+                    documents=[f"chunk {i}" for i in rows],
+                    metadatas=[{"url": f"https://example.com/{i}"} for i in rows]
+                )
+            export_collection(collection, root=root)
+            engines = {"hnsw": collection, "exact": ExactIndex(collection.name, root)}
+
+            queries = vectors[rng.choice(size, size=2 * n_queries)] + rng.normal(0, 0.05, (2 * n_queries, dim)).astype(np.float32)
+            latencies, found = {name: [] for name in engines}, {name: [] for name in engines}
+            for engine in engines.values():
+                engine.query(query_embeddings=queries[:2], n_results=k, include=include)  # Load the index first
+            for i in range(0, len(queries), 2):
+                for name, engine in engines.items():
+                    start = time.perf_counter()
+                    result = engine.query(query_embeddings=queries[i:i + 2], n_results=k, include=include)
+                    latencies[name].append((time.perf_counter() - start) * 1000)
+                    found[name].extend(set(ids) for ids in result["ids"])
+            recall = np.mean([len(h & e) / k for h, e in zip(found["hnsw"], found["exact"])])
+
+            results.append({
+                "documents": size,
+                **{f"{name}_ms": {"p50": round(percentile(ms, 50), 2), "p95": round(percentile(ms, 95), 2)} for name, ms in latencies.items()},
+                f"hnsw_recall@{k}": round(float(recall), 4)
+            })
+            engines["exact"].close()
+            client.delete_collection(collection.name)
+            print(json.dumps(results[-1]))
+    return results
+
+def compare(previous, current):
+    print(f"\nCompared with {previous['created']}:")
+    for library, result in current["results"].items():
+        before = previous["results"].get(library)
+        if not before:
+            continue
+        for key in ("p50", "p95", "p99"):
+            print(f"{library} latency {key}: {before['latency_ms'][key]} -> {result['latency_ms'][key]} ms")
+        for key in result:
+            if key.startswith(("recall@", "hit_rate@")) and key in before:
+                print(f"{library} {key}: {before[key]} -> {result[key]}")
+        print(f"{library} prompt tokens (mean): {before['prompt_tokens']['mean']} -> {result['prompt_tokens']['mean']}")
+
+########################################################
+# Main Execution
+########################################################
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.engines:
+        sizes = [int(size) for size in args.engine_sizes.split(",")]
+        report = {"created": str(datetime.now()), "engines": engine_benchmark(sizes)}
+        output = args.output or os.path.join(OUTPUT_DIR, f"engines-{datetime.now():%Y%m%d-%H%M%S}.json")
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {output}")
+        exit()
+
+    with open(QUESTIONS_PATH) as f:
+        question_set = yaml.safe_load(f)
+    libraries = args.library or sorted(question_set)
+
+    configure_service(args)
+    chat_service = service.ChatService(vector_path=VECTOR_PATH, use_cache=False)
+    stub = StubOpenAI(latency=args.llm_latency)
+
+    report = {
+        "created": str(datetime.now()),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": {}
+    }
+    for library_name in libraries:
+        report["results"][library_name] = asyncio.run(run_library(chat_service, library_name, question_set[library_name], args, stub))
+        print(f"{library_name}: {json.dumps(report['results'][library_name])}")
+
+    output = args.output or os.path.join(OUTPUT_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
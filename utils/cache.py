@@ -0,0 +1,114 @@
+import json
+import time
+import hashlib
+import logging
+
+########################################################
+# Configuration
+########################################################
+
+CACHE_COLLECTION = "answer_cache"
+
+########################################################
+# Semantic Cache
+########################################################
+
+class SemanticCache:
+
+    # Caches query expansions and answers in their own Chroma collection.
+    # A new query reuses an entry when it is within `threshold` cosine distance
+    # of a cached query for the same library, RAG setting, model and collection version
+    # (the library's live collection, so a promoted rebuild starts with an empty cache).
+    # With an embedder, the query vector is shared with retrieval through its LRU cache.
+    def __init__(self, CLIENT, threshold=0.08, ttl=7 * 24 * 3600, max_entries=2000, embedder=None):
+        self.collection = CLIENT.get_or_create_collection(
+            name=CACHE_COLLECTION,
+            metadata={"hnsw:space": "cosine", "description": "Semantic cache of expansions and answers"}
+        )
+        self.embedder = embedder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def _entry_id(self, query, library_name, use_rag, model, collection_name):
+        key = f"{library_name}|{use_rag}|{model}|{collection_name}|{' '.join(query.lower().split())}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _scope(self, library_name, use_rag, model, collection_name):
+        return {"library": library_name, "rag": use_rag, "model": model, "collection": collection_name}
+
+    def _query_args(self, query):
+        if self.embedder is not None:
+            return {"query_embeddings": self.embedder.embed_queries([query])}
+        return {"query_texts": [query]}
+
+    def lookup(self, query, library_name, use_rag, model="", collection_name=""):
+        scope = self._scope(library_name, use_rag, model, collection_name)
+        try:
+            result = self.collection.query(
+                **self._query_args(query),
+                where={"$and": [{k: v} for k, v in scope.items()]},
+                include=["metadatas", "distances"],
+                n_results=1
+            )
+        except Exception as e:
+            logging.warning(f"Cache lookup failed: {e}")
+            self.stats["misses"] += 1
+            return None
+
+        ids, metas, distances = result["ids"][0], result["metadatas"][0], result["distances"][0]
+        if not ids or distances[0] > self.threshold:
+            self.stats["misses"] += 1
+            return None
+
+        meta = metas[0]
+        if time.time() - meta["created"] > self.ttl:
+            self.collection.delete(ids=[ids[0]])
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        self.collection.update(ids=[ids[0]], metadatas=[{**meta, "last_hit": time.time(), "hits": meta["hits"] + 1}])
+        return {
+            "expansion": meta["expansion"],
+            "answer": meta["answer"],
+            "sources": json.loads(meta["sources"])
+        }
+
+    def put(self, query, library_name, use_rag, expansion="", answer="", sources=None, model="", collection_name=""):
+        now = time.time()
+        self.collection.upsert(
+            ids=[self._entry_id(query, library_name, use_rag, model, collection_name)],
+            documents=[query],
+            embeddings=self.embedder.embed_queries([query]) if self.embedder is not None else None,
+            metadatas=[{
+                **self._scope(library_name, use_rag, model, collection_name),
+                "expansion": expansion,
+                "answer": answer,
+                "sources": json.dumps(sources or []),
+                "created": now,
+                "last_hit": now,
+                "hits": 0
+            }]
+        )
+        # Evict in bulk once 10% over the limit so this doesn't run on every put
+        if self.collection.count() > self.max_entries * 1.1:
+            self.evict()
+
+    def evict(self):
+
+        # Drop expired entries, then least recently hit ones down to max_entries
+        entries = self.collection.get(include=["metadatas"])
+        now = time.time()
+        expired = {i for i, m in zip(entries["ids"], entries["metadatas"]) if now - m["created"] > self.ttl}
+        live = sorted(
+            ((m["last_hit"], i) for i, m in zip(entries["ids"], entries["metadatas"]) if i not in expired),
+            reverse=True
+        )
+        evicted = [i for _, i in live[self.max_entries:]]
+        if expired or evicted:
+            self.collection.delete(ids=list(expired) + evicted)
+        self.stats["expired"] += len(expired)
+        self.stats["evicted"] += len(evicted)
@@ -0,0 +1,67 @@
+import sqlite3
+from datetime import datetime
+
+########################################################
+# Utility Functions
+########################################################
+
+# Per-library scrape progress, committed as each batch lands in Chroma,
+# so an interrupted run can continue with scraper.py --resume
+
+def open_checkpoint(LIBRARY_NAME):
+    conn = sqlite3.connect(f"./logging/{LIBRARY_NAME}_checkpoint.sqlite3", check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS links ("
+        "url TEXT PRIMARY KEY, scraped INTEGER DEFAULT 0, failures INTEGER DEFAULT 0, "
+        "last_error TEXT DEFAULT '', updated TEXT)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+def reset_checkpoint(conn):
+    with conn:
+        conn.execute("DELETE FROM links")
+        conn.execute("DELETE FROM state")
+
+def set_state(conn, key, value):
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, str(value)))
+
+def get_state(conn, key, default=None):
+    row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def add_links(conn, urls):
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO links (url, updated) VALUES (?, ?)",
+            [(u, str(datetime.now())) for u in urls]
+        )
+
+def mark_scraped(conn, urls):
+    with conn:
+        conn.executemany(
+            "UPDATE links SET scraped = 1, updated = ? WHERE url = ?",
+            [(str(datetime.now()), u) for u in urls]
+        )
+
+def record_failure(conn, url, error):
+    with conn:
+        conn.execute(
+            "UPDATE links SET failures = failures + 1, last_error = ?, updated = ? WHERE url = ?",
+            (error[:500], str(datetime.now()), url)
+        )
+
+def pending_links(conn, max_failures=None):
+    if max_failures is None:
+        rows = conn.execute("SELECT url FROM links WHERE scraped = 0 ORDER BY url")
+    else:
+        rows = conn.execute("SELECT url FROM links WHERE scraped = 0 AND failures < ? ORDER BY url", (max_failures,))
+    return [r[0] for r in rows]
+
+def progress(conn):
+    scraped, total, failing = conn.execute(
+        "SELECT SUM(scraped), COUNT(*), SUM(CASE WHEN scraped = 0 AND failures > 0 THEN 1 ELSE 0 END) FROM links"
+    ).fetchone()
+    return {"scraped": scraped or 0, "total": total, "failing": failing or 0}
@@ -1,168 +1,457 @@
 import re
-import time
-import uuid
+import hashlib
 import logging
 import asyncio
-import requests
+from contextlib import AsyncExitStack, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 import pandas as pd
 from datetime import datetime
-from urllib.parse import urldefrag, urlparse, parse_qs
-import xml.etree.ElementTree as ET
 from playwright.async_api import async_playwright
+from aliases import resolve_collection, next_version_name
+from lexical import open_index, add_documents, delete_documents
+from embeddings import get_embedder
+from fetcher import USER_AGENT, create_http_client, fetch_html, extract_blocks, extract_links, extract_page_meta
+from crawler import PrefixTrie, HostThrottle, RobotsCache, normalize_url, load_sitemap_lastmod, crawl_frontier
+from sitemap import discover_sitemaps, stream_sitemap
+from checkpoint import open_checkpoint, add_links, record_failure, mark_scraped as checkpoint_scraped
 
 ########################################################
-# Utility Functions
+# Constants
 ########################################################
 
-def setup_collection(CLIENT, LIBRARY_NAME):
-
-    collections = CLIENT.list_collections()
-
-    if any(c.name == f"{LIBRARY_NAME}_docs" for c in collections):
-        # Note: deleting before creating is risky behaviour, fix later
-        logging.info(f"Replacing existing '{LIBRARY_NAME}_docs' collection...")
-        CLIENT.delete_collection(name=f"{LIBRARY_NAME}_docs")
-        time.sleep(5)
-        CLIENT.create_collection(
-            name=f"{LIBRARY_NAME}_docs",
-            metadata={
-                "description": f"Documentation for {LIBRARY_NAME}",
-                "created": str(datetime.now())
-            }  
-        )
-    else:
-        logging.info(f"A new collection will be created...")
-        CLIENT.create_collection(
-            name=f"{LIBRARY_NAME}_docs",
-            metadata={
-                "description": f"Documentation for {LIBRARY_NAME}",
-                "created": str(datetime.now())
-            }  
-        )
+MAX_REMOVED_FRACTION = 0.1  # Incremental runs remove at most this share of a library's stored pages
+
+# Walks the scraped element in document order and returns flat blocks of
+# headings, code and prose, each tagged with the nearest section anchor
+EXTRACT_BLOCKS_JS = """
+(root) => {
+    const blocks = [];
+    let anchor = "";
+    let section = "";
+    const push = (type, text, level) => {
+        if (text && text.trim()) blocks.push({type, text, anchor, section, level: level || 0});
+    };
+    const walk = (node) => {
+        for (const child of node.childNodes) {
+            if (child.nodeType === Node.TEXT_NODE) {
+                push("text", child.textContent);
+                continue;
+            }
+            if (child.nodeType !== Node.ELEMENT_NODE) continue;
+            const tag = child.tagName.toLowerCase();
+            if (/^h[1-6]$/.test(tag)) {
+                const holder = child.id ? child : child.closest("section[id], div.section[id]");
+                anchor = holder ? holder.id : "";
+                section = child.innerText.replace(/[\u00b6#]\s*$/, "").trim();
+                push("heading", section, Number(tag[1]));
+            } else if (tag === "pre") {
+                push("code", child.innerText);
+            } else if (child.querySelector("h1, h2, h3, h4, h5, h6, pre")) {
+                walk(child);
+            } else {
+                push("text", child.innerText);
+            }
+        }
+    };
+    walk(root);
+    return blocks;
+}
+"""
 
-async def fetch_links(BASE_URL, LIBRARY_NAME, EXCLUDE_URL=None, max_links=None, concurrency = 5, sleep = 0):
-    
-    if EXCLUDE_URL is None:
-        EXCLUDE_URL = []
+########################################################
+# Write Buffer
+########################################################
 
-    all_links = set()
-    to_crawl = []
+class ChromaWriteBuffer:
+    
+    # Collects documents from the scraping workers and writes them to Chroma in batches,
+    # flushing when max_docs or max_bytes is reached, or every flush_interval seconds.
+    # Embedding and writes run in a worker thread.
+    # If a lexical index connection is given, each batch is also written there
+    # (fresh=True when the collection is built from scratch, so no old rows need replacing).
+    # An executor can be passed to share one pool of embedding threads across collections.
+    def __init__(self, collection, max_docs=64, max_bytes=2_000_000, flush_interval=5.0, on_flushed=None, lexical=None,
+                 executor=None, embedder=None, fresh=False):
+        self.collection = collection
+        self.fresh = fresh
+        self.executor = executor
+        self.embedder = embedder or get_embedder()
+        self.lexical = lexical
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.on_flushed = on_flushed
+        self._ids, self._documents, self._metadatas, self._urls = [], [], [], []
+        self._bytes = 0
+        self._full = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._writer = None
+        self._closing = False
+
+    async def __aenter__(self):
+        self._writer = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._closing = True
+        self._full.set()
+        await self._writer
+
+    async def add(self, url, ids, documents, metadatas):
+        # Backpressure: don't let workers run too far ahead of the writer
+        while len(self._ids) >= 4 * self.max_docs:
+            self._drained.clear()
+            await self._drained.wait()
+        self._ids.extend(ids)
+        self._documents.extend(documents)
+        self._metadatas.extend(metadatas)
+        self._urls.append(url)
+        self._bytes += sum(len(d.encode("utf-8")) for d in documents)
+        if len(self._ids) >= self.max_docs or self._bytes >= self.max_bytes:
+            self._full.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self._flush()
+            if self._closing and not self._ids:
+                break
 
-    # Initialize with defragmented + no query BASE_URL
-    for url in BASE_URL:
-        url_no_frag = urldefrag(url).url
-        if urlparse(url_no_frag).query: 
-            continue
-        all_links.add(url_no_frag)
-        to_crawl.append(url_no_frag)
+    async def _flush(self):
+        if not self._ids:
+            return
+        ids, documents, metadatas, urls = self._ids, self._documents, self._metadatas, self._urls
+        self._ids, self._documents, self._metadatas, self._urls = [], [], [], []
+        self._bytes = 0
+        self._drained.set()
+
+        for start in range(0, len(ids), self.max_docs):
+            end = start + self.max_docs
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self._write, ids[start:end], documents[start:end], metadatas[start:end]
+                )
+            except Exception as e:
+                logging.warning(f"Failed to write batch of {len(ids[start:end])} chunks: {e}")
+                # Drop the urls of the failed batch so they are not marked as scraped
+                failed = {m["url"] for m in metadatas[start:end]}
+                urls = [u for u in urls if u not in failed]
+        logging.info(f"Flushed {len(ids)} chunks to '{self.collection.name}'")
+
+        if self.on_flushed and urls:
+            self.on_flushed(urls)
+
+    def _write(self, ids, documents, metadatas):
+        # Upsert so re-scraped pages overwrite their stable chunk ids
+        embeddings = self.embedder.embed_documents(documents)
+        self.collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        if self.lexical is not None:
+            add_documents(self.lexical, self.collection.name, ids, documents, metadatas, fresh=self.fresh)
+
+class LazyBrowser:
+
+    # Launches Chromium on first use, so runs over static sites never start a browser
+    def __init__(self, playwright):
+        self.playwright = playwright
+        self.browser = None
+        self._lock = asyncio.Lock()
+
+    async def get(self):
+        async with self._lock:
+            if self.browser is None:
+                logging.info("Launching browser...")
+                self.browser = await self.playwright.chromium.launch()
+        return self.browser
+
+    async def close(self):
+        if self.browser is not None:
+            await self.browser.close()
+
+class WorkerPool:
+
+    # Browser, HTTP client and embedding threads for a whole run. Libraries scraped in
+    # parallel share it, so the global and per-host limits hold across all of them.
+    def __init__(self, browser_concurrency=3, http_concurrency=10, host_concurrency=4, embed_workers=1, rate_limit=None,
+                 embedder=None):
+        self.browser_concurrency = browser_concurrency
+        self.http_concurrency = http_concurrency
+        self.host_concurrency = host_concurrency
+        self.embed_workers = embed_workers
+        self.embedder = embedder or get_embedder()
+        self.throttle = HostThrottle(rate_limit)
+        self._host_slots = {}
+        self._stack = AsyncExitStack()
+
+    async def __aenter__(self):
+        playwright = await self._stack.enter_async_context(async_playwright())
+        self.http = await self._stack.enter_async_context(create_http_client(self.http_concurrency))
+        self.browser = LazyBrowser(playwright)
+        self._stack.push_async_callback(self.browser.close)
+        self.embed_executor = ThreadPoolExecutor(max_workers=self.embed_workers, thread_name_prefix="embed")
+        self._stack.callback(self.embed_executor.shutdown)
+        self._browser_slots = asyncio.Semaphore(self.browser_concurrency)
+        self._http_slots = asyncio.Semaphore(self.http_concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._stack.aclose()
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.host_concurrency)
+        return self._host_slots[host]
+
+    @asynccontextmanager
+    async def http_slot(self, url):
+        async with self._host_slot(url), self._http_slots:
+            yield
+
+    @asynccontextmanager
+    async def browser_slot(self, url):
+        async with self._host_slot(url), self._browser_slots:
+            yield
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-        context = await browser.new_context()
+########################################################
+# Utility Functions
+########################################################
 
-        semaphore = asyncio.Semaphore(concurrency)
+def setup_collection(CLIENT, LIBRARY_NAME, incremental=False, hnsw=None):
+
+    metadata = {
+        "description": f"Documentation for {LIBRARY_NAME}",
+        "created": str(datetime.now()),
+        "embedding": get_embedder().name
+    }
+
+    if incremental:
+        # Keep the live collection, scrape_page only applies the diff
+        name = resolve_collection(LIBRARY_NAME)
+        logging.info(f"Updating '{name}' collection incrementally...")
+        CLIENT.get_or_create_collection(name=name, metadata=metadata)
+        return name
+
+    # Build into a new staging version, the live one keeps serving until promote_collection
+    name = next_version_name(CLIENT, LIBRARY_NAME)
+    logging.info(f"Building new collection '{name}'...")
+    # HNSW settings tuned with monitor.py can be pinned per library in libraries.yaml
+    configuration = {"hnsw": hnsw} if hnsw else None
+    CLIENT.create_collection(name=name, metadata=metadata, configuration=configuration)
+    return name
+
+async def fetch_links(BASE_URL, LIBRARY_NAME, EXCLUDE_URL=None, max_links=None, concurrency = 5, sleep = 0, render_js = False,
+                      max_depth = None, rate_limit = 2.0, respect_robots = True, sitemap_path = None, pool = None, stats = None):
+
+    # Pages that failed to load are counted in stats["failed"], see scrape_page's links_complete
+    if EXCLUDE_URL is None:
+        EXCLUDE_URL = []
 
-        async def crawl(url):
-            async with semaphore:
-                page = await context.new_page()
+    # Prefix tries over normalized prefixes, so they compare like normalized links
+    include = PrefixTrie(normalize_url(u) or u for u in BASE_URL)
+    exclude = PrefixTrie(normalize_url(u) or u for u in EXCLUDE_URL)
+
+    async with AsyncExitStack() as stack:
+        # A shared pool (and its per-host rate limit) comes from the caller when scraping several libraries
+        if pool is None:
+            pool = await stack.enter_async_context(
+                WorkerPool(browser_concurrency=concurrency, http_concurrency=concurrency, rate_limit=rate_limit)
+            )
+
+        async def page_links(url):
+            # Plain HTTP first, the browser only if that yields nothing
+            if not render_js:
+                async with pool.http_slot(url):
+                    html, _, final_url = await fetch_html(pool.http, url)
+                links = extract_links(html, final_url) if html else []
+                if links:
+                    return links
+            async with pool.browser_slot(url):
+                browser = await pool.browser.get()
+                page = await browser.new_page()
                 try:
-                    logging.info(f"Crawling: {url}")
-                    await page.goto(url)
+                    response = await page.goto(url)
+                    if response and response.status >= 400:
+                        raise ValueError(f"HTTP {response.status}")
                     await asyncio.sleep(sleep)
-                    links = await page.eval_on_selector_all('a', 'els => els.map(e => e.href)')
-
-                    # Ensure defragmented + no query links only
-                    for link in links:
-                        if any(link.startswith(base) for base in BASE_URL) and link not in EXCLUDE_URL:
-                            url_no_frag = urldefrag(link).url
-                            if urlparse(url_no_frag).query:  # skip query links
-                                continue
-                            if url_no_frag not in all_links:
-                                all_links.add(url_no_frag)
-                                to_crawl.append(url_no_frag)   # only defragmented URL added
-
-                except Exception as e:
-                    logging.warning(f"Failed to load {url}: {e}")
+                    return await page.eval_on_selector_all('a', 'els => els.map(e => e.href)')
                 finally:
                     await page.close()
 
-        while to_crawl:
-            tasks = [crawl(to_crawl.pop()) for _ in range(min(concurrency, len(to_crawl)))]
-            await asyncio.gather(*tasks)
-
-            if max_links is not None and len(all_links) >= max_links:
-                logging.info(f"Reached max_links={max_links}, stopping crawl.")
-                break
-
-        await browser.close()
+        all_links = await crawl_frontier(
+            BASE_URL,
+            page_links,
+            include,
+            exclude,
+            workers=concurrency,
+            max_links=max_links,
+            max_depth=max_depth,
+            throttle=pool.throttle,
+            robots=RobotsCache(pool.http, USER_AGENT) if respect_robots else None,
+            stats=stats
+        )
 
-    filtered_links = [
-        link for link in all_links 
-        if not any(link.startswith(prefix) for prefix in EXCLUDE_URL)
-    ]
+    filtered_links = sorted(all_links)
     df = pd.DataFrame(filtered_links, columns=["Links"])
     df["Scraped"] = False
+    if sitemap_path:
+        # lastmod from a sitemap saved on disk lets incremental runs skip unchanged pages
+        lastmods = load_sitemap_lastmod(sitemap_path)
+        df["Lastmod"] = [lastmods.get(u, "") for u in filtered_links]
     df.to_csv(f"./logging/{LIBRARY_NAME}_links.csv", index=False)
     logging.info(f"Total unique links saved: {len(filtered_links)}")
     
-    return list(filtered_links)
-
-def fetch_sitemap(ROOT_URL, BASE_URL, LIBRARY_NAME,  EXCLUDE_URL=None):
-    def _parse_sitemap(url):
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        root = ET.fromstring(resp.content)
-        namespace = {"sm": "http://www.sitemaps.org/schemas/sitemap/0.9"}
-        # Collect URLs
-        urls = [loc.text for loc in root.findall(".//sm:loc", namespace)]
-        return urls
-
-    # Start with the root sitemap
-    sitemap_url = ROOT_URL.rstrip("/") + "/sitemap.xml"
-    urls = _parse_sitemap(sitemap_url)
-    all_links = []
-
-    # If it's a sitemap index → fetch each sub-sitemap
-    if all(u.endswith(".xml") for u in urls):
-        for sm in urls:
-            all_links.extend(_parse_sitemap(sm))
-    else:
-        all_links.extend(urls)
-
-    # Filter by BASE_URL
-    filtered = [u for u in all_links if any(u.startswith(base) for base in BASE_URL)]
-    # Exclude by EXCLUDE_URL
+    return filtered_links
+
+async def fetch_sitemap(ROOT_URL, BASE_URL, LIBRARY_NAME, EXCLUDE_URL=None, concurrency = 8, max_depth = 3, pool = None, stats = None):
+
     if EXCLUDE_URL is None:
         EXCLUDE_URL = []
-    filtered_links = [u for u in filtered if not any(u.startswith(prefix) for prefix in EXCLUDE_URL)]
 
+    # Same normalized prefix tries as fetch_links, applied while the sitemaps stream in
+    include = PrefixTrie(normalize_url(u) or u for u in BASE_URL)
+    exclude = PrefixTrie(normalize_url(u) or u for u in EXCLUDE_URL)
+
+    lastmods = {}
+    async with AsyncExitStack() as stack:
+        if pool is None:
+            pool = await stack.enter_async_context(WorkerPool(http_concurrency=concurrency, host_concurrency=concurrency))
+        sitemap_urls = await discover_sitemaps(pool.http, ROOT_URL)
+        async for url, lastmod in stream_sitemap(
+            pool.http,
+            sitemap_urls,
+            include,
+            exclude,
+            concurrency=concurrency,
+            max_depth=max_depth,
+            slot=pool.http_slot,
+            stats=stats
+        ):
+            lastmods[url] = lastmod
+
+    filtered_links = sorted(lastmods)
     df = pd.DataFrame(filtered_links, columns=["Links"])
     df["Scraped"] = False
+    df["Lastmod"] = [lastmods[u] for u in filtered_links]
     df.to_csv(f"./logging/{LIBRARY_NAME}_links.csv", index=False)
     logging.info(f"Total unique links saved: {len(filtered_links)}")
 
-    return sorted(set(filtered_links))
+    return filtered_links
 
-async def scrape_page(urls, CLIENT, TAG_TO_SCRAPE, LIBRARY_NAME, timeout = 30000, concurrency = 5, sleep = 0):
-    collection = CLIENT.get_collection(name=f"{LIBRARY_NAME}_docs")
+async def scrape_page(urls, CLIENT, TAG_TO_SCRAPE, LIBRARY_NAME, timeout = 30000, concurrency = 5, sleep = 0, chunk_size = None, chunk_overlap = 50,
+                      batch_size = 64, batch_bytes = 2_000_000, flush_interval = 5.0, incremental = False, collection_name = None,
+                      max_retries = 2, retry_backoff = 2.0, resume = False, render_js = False, http_concurrency = 10, pool = None,
+                      links_complete = False, max_removed = MAX_REMOVED_FRACTION):
+    collection = CLIENT.get_collection(name=collection_name or resolve_collection(LIBRARY_NAME))
     total_count = len(urls)
     scraped_count = 0
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0, "http": 0, "browser": 0}
 
     df = pd.read_csv(f"./logging/{LIBRARY_NAME}_links.csv")
+    lastmods = dict(zip(df["Links"], df["Lastmod"].fillna(""))) if "Lastmod" in df.columns else {}
     
-    # Limit number of concurrent pages
-    semaphore = asyncio.Semaphore(concurrency)
-
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-
-        async def scrape(url):
-            nonlocal scraped_count
-            async with semaphore:
+    # Progress is checkpointed per flushed batch, so an interrupted run can be resumed
+    checkpoint = open_checkpoint(LIBRARY_NAME)
+    add_links(checkpoint, urls)
+    
+    def mark_scraped(flushed_urls):
+        df.loc[df['Links'].isin(flushed_urls), 'Scraped'] = True
+        checkpoint_scraped(checkpoint, flushed_urls)
+
+    # In incremental mode, compare against what is already stored and drop pages that disappeared.
+    # A resumed run only gets the pending links, so nothing is treated as removed. Neither is anything
+    # when link discovery hit failures (links_complete=False, an outage would look like a removed site),
+    # or when more than max_removed of the stored pages would go.
+    known = _load_page_index(collection) if incremental else {}
+    url_set = set(urls)
+    removed = [url for url in known if url not in url_set] if not resume else []
+    if removed and not (links_complete and urls):
+        reason = "found no links" if not urls else "was incomplete"
+        logging.warning(f"Link discovery {reason}, keeping {len(removed)} stored pages it didn't find")
+        removed = []
+    elif removed and len(removed) > max_removed * len(known):
+        logging.warning(
+            f"Not removing {len(removed)} of {len(known)} stored pages (over {max_removed:.0%}), "
+            f"rerun with --allow-removals if they are really gone"
+        )
+        removed = []
+    lexical = open_index()
+    for url in removed:
+        collection.delete(ids=known[url]["ids"])
+        delete_documents(lexical, collection.name, known[url]["ids"])
+    stats["removed"] = len(removed)
+    
+    async with AsyncExitStack() as stack:
+        # Limit number of concurrent pages, unless the caller shares a pool across libraries
+        if pool is None:
+            pool = await stack.enter_async_context(
+                WorkerPool(browser_concurrency=concurrency, http_concurrency=http_concurrency, host_concurrency=http_concurrency)
+            )
+        buffer = await stack.enter_async_context(ChromaWriteBuffer(
+            collection,
+            max_docs=batch_size,
+            max_bytes=batch_bytes,
+            flush_interval=flush_interval,
+            on_flushed=mark_scraped,
+            lexical=lexical,
+            executor=pool.embed_executor,
+            embedder=pool.embedder,
+            fresh=not incremental and not resume
+        ))
+
+        async def scrape_once(url):
+            prev = known.get(url)
+
+            # Cheap checks first: unchanged sitemap lastmod or ETag means no reload at all.
+            # Pages stored without page metadata (doc_type etc.) are reloaded once to add it.
+            lastmod = lastmods.get(url, "")
+            if prev and not prev["doc_type"]:
+                prev = {**prev, "lastmod": "", "etag": ""}
+            if prev and lastmod and prev["lastmod"] == lastmod:
+                logging.info(f"Unchanged (lastmod): {url}")
+                stats["unchanged"] += 1
+                mark_scraped([url])
+                return
+            if prev and prev["etag"]:
+                async with pool.http_slot(url):
+                    head = await pool.http.head(url)
+                if head.headers.get("etag", "") == prev["etag"]:
+                    logging.info(f"Unchanged (etag): {url}")
+                    stats["unchanged"] += 1
+                    mark_scraped([url])
+                    return
+
+            # Plain HTTP + HTML parsing first, Chromium only for JS-rendered pages
+            blocks, etag, html = [], "", None
+            if not render_js:
+                async with pool.http_slot(url):
+                    logging.info(f"Fetching page: {url}")
+                    html, etag, _ = await fetch_html(pool.http, url)
+                if html:
+                    blocks = extract_blocks(html, TAG_TO_SCRAPE)
+                if not blocks:
+                    logging.info(f"Nothing extracted over HTTP, falling back to browser: {url}")
+            if not blocks:
+                # Every page rendered in Chromium, render_js libraries and HTTP fallbacks alike
+                stats["browser"] += 1
+                blocks, etag, html = await browser_blocks(url)
+            else:
+                stats["http"] += 1
+            await store_blocks(url, prev, lastmod, etag, blocks, extract_page_meta(html, url))
+
+        async def browser_blocks(url):
+            async with pool.browser_slot(url):
+                browser = await pool.browser.get()
                 page = await browser.new_page()
                 try:
                     logging.info(f"Loading page: {url}")
-                    await page.goto(url, wait_until="domcontentloaded", timeout=timeout)
+                    response = await page.goto(url, wait_until="domcontentloaded", timeout=timeout)
+                    etag = response.headers.get("etag", "") if response else ""
                     
                     logging.info("Scraping data...")
                     await asyncio.sleep(sleep)
@@ -174,40 +463,247 @@ async def scrape_page(urls, CLIENT, TAG_TO_SCRAPE, LIBRARY_NAME, timeout = 30000
                     content = await element.inner_text()
                     if not content.strip():
                         raise ValueError(f"Element found for selector {TAG_TO_SCRAPE} is empty")
-                    
-                    logging.info("Processing data...")
-                    content = _data_preprocessing(content)
-
-                    logging.info("Adding data...")
-                    uid = str(uuid.uuid4())
-                    collection.add(
-                        ids=[uid],
-                        documents=[content],
-                        metadatas=[{"url": url}]
-                    )
-                    logging.info(f"Added page content from {url}")
-
-                    if url in df['Links'].values:
-                        df.loc[df['Links'] == url, 'Scraped'] = True
-                        
-                except Exception as e:
-                    logging.warning(f"Failed to add content from {url}: {e}")
-                    
+                    blocks = await element.evaluate(EXTRACT_BLOCKS_JS)
+                    if not blocks:
+                        blocks = [{"type": "text", "text": content, "anchor": "", "section": ""}]
+                    return blocks, etag, await page.content()
                 finally:
                     await page.close()
-                    scraped_count += 1
-                    logging.info(f"Done with {scraped_count}/{total_count} links...")
+
+        async def store_blocks(url, prev, lastmod, etag, blocks, page_meta):
+            logging.info("Processing data...")
+            for block in blocks:
+                block["text"] = _data_preprocessing(block["text"])
+            chunks = _chunk_blocks(blocks, chunk_size, chunk_overlap, pool.embedder.count_tokens)
+            if not chunks:
+                raise ValueError(f"No chunks produced for {url}")
+
+            content_hash = hashlib.sha256("\n".join(c["text"] for c in chunks).encode("utf-8")).hexdigest()
+            ids = [_chunk_id(url, i) for i in range(len(chunks))]
+            # Title, breadcrumb, version and page type are filterable with `where` at query time
+            metadatas = [
+                {
+                    "url": url, "anchor": c["anchor"], "section": c["section"], "section_path": c["section_path"],
+                    "is_code": c["is_code"], "chunk": i, **page_meta,
+                    "content_hash": content_hash, "lastmod": lastmod, "etag": etag
+                }
+                for i, c in enumerate(chunks)
+            ]
+            if prev and prev["hash"] == content_hash:
+                logging.info(f"Unchanged (content): {url}")
+                # Refresh change markers (and page metadata missing on older entries) only, metadata updates don't re-embed
+                if (prev["lastmod"], prev["etag"]) != (lastmod, etag) or not prev["doc_type"]:
+                    await asyncio.to_thread(collection.update, ids=ids, metadatas=metadatas)
+                stats["unchanged"] += 1
+                mark_scraped([url])
+                return
+
+            logging.info("Adding data...")
+            await buffer.add(
+                url,
+                ids=ids,
+                documents=[c["text"] for c in chunks],
+                metadatas=metadatas
+            )
+            # Page shrank (or was stored under old ids): remove leftover chunks
+            if prev:
+                stale = [i for i in prev["ids"] if i not in set(ids)]
+                if stale:
+                    await asyncio.to_thread(collection.delete, ids=stale)
+                    await asyncio.to_thread(delete_documents, lexical, collection.name, stale)
+            stats["updated" if prev else "added"] += 1
+            logging.info(f"Queued {len(chunks)} chunks from {url}")
+
+        async def scrape(url):
+            nonlocal scraped_count
+            # Retry with exponential backoff, sleeping outside the semaphore so other pages keep going
+            for attempt in range(max_retries + 1):
+                try:
+                    await scrape_once(url)
+                    break
+                except Exception as e:
+                    record_failure(checkpoint, url, str(e))
+                    if attempt == max_retries:
+                        logging.warning(f"Failed to add content from {url}: {e}")
+                        stats["failed"] += 1
+                    else:
+                        delay = retry_backoff * 2 ** attempt
+                        logging.info(f"Retrying {url} in {delay}s: {e}")
+                        await asyncio.sleep(delay)
+            scraped_count += 1
+            logging.info(f"Done with {scraped_count}/{total_count} links...")
 
         tasks = [scrape(url) for url in urls]
         await asyncio.gather(*tasks)
-
-        await browser.close()
         
+    lexical.close()
+    checkpoint.close()
     df.to_csv(f"./logging/{LIBRARY_NAME}_links.csv", index=False)
+    logging.info(
+        f"Pages added: {stats['added']}, updated: {stats['updated']}, "
+        f"unchanged: {stats['unchanged']}, removed: {stats['removed']}, failed: {stats['failed']}"
+    )
+    logging.info(f"Pages fetched over HTTP: {stats['http']}, browser fallbacks: {stats['browser']}")
+    return stats
+
+def _chunk_id(url, ordinal):
+    
+    # Stable across runs so re-scraping a page overwrites its own chunks
+    return f"{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}-{ordinal}"
+
+def _load_page_index(collection):
+    
+    # Map each stored url to its chunk ids and change markers
+    index = {}
+    stored = collection.get(include=["metadatas"])
+    for uid, meta in zip(stored["ids"], stored["metadatas"]):
+        meta = meta or {}
+        url = meta.get("url")
+        if not url:
+            continue
+        page = index.setdefault(url, {"ids": [], "hash": "", "lastmod": "", "etag": "", "doc_type": ""})
+        page["ids"].append(uid)
+        page["doc_type"] = meta.get("doc_type", page["doc_type"])
+        page["hash"] = meta.get("content_hash", page["hash"])
+        page["lastmod"] = meta.get("lastmod", page["lastmod"])
+        page["etag"] = meta.get("etag", page["etag"])
+    return index
 
 def _data_preprocessing(content):
     
     # Remove excessive whiteline but preserve code formatting
     content = re.sub(r'\n{2,}', '\n', content)
     
-    return content
\ No newline at end of file
+    return content
+
+def _split_line(line, chunk_size, chunk_overlap, count):
+
+    # Windows of whole words within chunk_size tokens, overlapping by up to chunk_overlap tokens.
+    # A single "word" over budget (minified code, long URLs) is cut by characters first.
+    words = []
+    for word in line.split(" "):
+        while count(word) > chunk_size:
+            cut = max(len(word) * chunk_size // count(word), 1)
+            while cut > 1 and count(word[:cut]) > chunk_size:
+                cut = cut * 9 // 10
+            words.append(word[:cut])
+            word = word[cut:]
+        words.append(word)
+
+    pieces, current, current_tokens = [], [], 0
+    for word in words:
+        tokens = count(word)
+        if current and current_tokens + tokens > chunk_size:
+            pieces.append(" ".join(current))
+            overlap, overlap_tokens = [], 0
+            for prev in reversed(current):
+                overlap_tokens += count(prev)
+                if overlap_tokens > chunk_overlap:
+                    break
+                overlap.insert(0, prev)
+            current, current_tokens = overlap, sum(count(w) for w in overlap)
+        current.append(word)
+        current_tokens += tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+def _split_block(text, chunk_size, chunk_overlap, count):
+    
+    # Split an oversized block on line boundaries, falling back to token windows for long lines
+    pieces = []
+    for line in text.split("\n"):
+        if count(line) <= chunk_size:
+            pieces.append(line)
+        else:
+            pieces.extend(_split_line(line, chunk_size, chunk_overlap, count))
+
+    parts, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = count(piece)
+        if current and current_tokens + tokens > chunk_size:
+            parts.append("\n".join(current))
+            # Carry trailing lines over as overlap
+            overlap, overlap_tokens = [], 0
+            for prev in reversed(current):
+                overlap_tokens += count(prev)
+                if overlap_tokens > chunk_overlap:
+                    break
+                overlap.insert(0, prev)
+            current, current_tokens = overlap, sum(count(p) for p in overlap)
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        parts.append("\n".join(current))
+    return parts
+
+def _chunk_blocks(blocks, chunk_size=None, chunk_overlap=50, count=None):
+    
+    # chunk_size bounds a whole chunk, section header included, in the embedder's tokens (count),
+    # and defaults to the embedder's input window, so no chunk is truncated when embedded.
+    # Group blocks into sections, a new section starts at every heading.
+    # Each section keeps the trail of headings above it (e.g. "Image Module > Functions > open").
+    if count is None:
+        count = get_embedder().count_tokens
+    if chunk_size is None:
+        chunk_size = get_embedder().max_tokens
+    sections, trail = [], []
+    for block in blocks:
+        if block["type"] == "heading":
+            level = block.get("level") or 2
+            trail = [t for t in trail if t[0] < level] + [(level, block["section"])]
+        if block["type"] == "heading" or not sections:
+            sections.append({
+                "anchor": block["anchor"], "section": block["section"],
+                "section_path": " > ".join(t for _, t in trail), "units": []
+            })
+        if block["type"] != "heading":
+            sections[-1]["units"].append((block["text"].strip("\n"), block["type"] == "code"))
+
+    chunks = []
+    for sec in sections:
+        # Section title is repeated on each chunk so it still makes sense on its own,
+        # the rest of the budget goes to the section's text. A title over half the budget is cut
+        # to that half, so header and text together always fit in chunk_size.
+        title = sec["section"]
+        if title and count(title) > chunk_size // 2:
+            title = _split_line(title, chunk_size // 2, 0, count)[0]
+        header = f"{title}\n" if title else ""
+        budget = chunk_size - count(header)
+
+        # Oversized paragraphs or code blocks are split, everything else stays whole
+        units = []
+        for unit, is_code in sec["units"]:
+            if count(unit) > budget:
+                units.extend((part, is_code) for part in _split_block(unit, budget, chunk_overlap, count))
+            elif unit.strip():
+                units.append((unit, is_code))
+        if not units:
+            continue
+
+        def make_chunk(current):
+            # A passage counts as code when code blocks make up most of it
+            code_tokens = sum(count(u) for u, is_code in current if is_code)
+            return {
+                "text": header + "\n".join(u for u, _ in current), "anchor": sec["anchor"], "section": sec["section"],
+                "section_path": sec["section_path"], "is_code": code_tokens * 2 >= sum(count(u) for u, _ in current)
+            }
+
+        current, current_tokens = [], 0
+        for unit in units:
+            tokens = count(unit[0])
+            if current and current_tokens + tokens > budget:
+                chunks.append(make_chunk(current))
+                overlap, overlap_tokens = [], 0
+                for prev in reversed(current):
+                    overlap_tokens += count(prev[0])
+                    if overlap_tokens > chunk_overlap:
+                        break
+                    overlap.insert(0, prev)
+                current, current_tokens = overlap, sum(count(u) for u, _ in overlap)
+            current.append(unit)
+            current_tokens += tokens
+        if current:
+            chunks.append(make_chunk(current))
+
+    return chunks
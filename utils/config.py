@@ -0,0 +1,46 @@
+import os
+import json
+import hashlib
+
+########################################################
+# Configuration
+########################################################
+
+LIBRARIES_PATH = "./utils/libraries.yaml"
+LIBRARIES_CACHE_PATH = "./utils/.libraries.json"  # Parsed copy, written on first load (and at image build)
+
+_libraries = {}
+
+########################################################
+# Library Config
+########################################################
+
+def load_libraries(path=LIBRARIES_PATH, cache_path=LIBRARIES_CACHE_PATH):
+
+    # Parsed libraries.yaml. The JSON copy is keyed by the YAML's hash, so PyYAML is only
+    # imported (and the YAML parsed) after an edit; within a process the result is memoized.
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()
+    if path in _libraries and _libraries[path][0] == digest:
+        return _libraries[path][1]
+
+    data = None
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached["sha1"] == digest:
+            data = cached["libraries"]
+    except (OSError, ValueError, KeyError):
+        pass
+    if data is None:
+        import yaml
+        data = yaml.safe_load(raw)
+        try:
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+            with open(cache_path, "w") as f:
+                json.dump({"sha1": digest, "libraries": data}, f)
+        except OSError:
+            pass  # Read-only filesystem, parse again next process
+    _libraries[path] = (digest, data)
+    return data
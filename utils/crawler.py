@@ -0,0 +1,173 @@
+import re
+import time
+import asyncio
+import logging
+import xml.etree.ElementTree as ET
+from urllib.parse import urldefrag, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+
+########################################################
+# URL Helpers
+########################################################
+
+class PrefixTrie:
+
+    # Character trie over URL prefixes, a lookup costs one walk over the URL
+    # instead of a startswith() per configured prefix
+    def __init__(self, prefixes=()):
+        self.root = {}
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix):
+        node = self.root
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node[None] = True
+
+    def match(self, url):
+        node = self.root
+        if None in node:
+            return True
+        for ch in url:
+            node = node.get(ch)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+def normalize_url(url):
+
+    # Canonical form used for the seen-set: no fragment, lowercase scheme/host,
+    # no default port and no repeated slashes. Returns None for query links.
+    url = urldefrag(url).url
+    parts = urlsplit(url)
+    if parts.query or parts.scheme not in ("http", "https"):
+        return None
+    host = parts.hostname or ""
+    if parts.port and not (parts.scheme, parts.port) in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    return urlunsplit((parts.scheme.lower(), host, path, "", ""))
+
+def load_sitemap_lastmod(path):
+
+    # Reads <loc>/<lastmod> pairs from a sitemap saved on disk
+    namespace = {"sm": "http://www.sitemaps.org/schemas/sitemap/0.9"}
+    lastmods = {}
+    for entry in ET.parse(path).getroot():
+        loc = entry.find("sm:loc", namespace)
+        lastmod = entry.find("sm:lastmod", namespace)
+        if loc is not None and loc.text:
+            url = normalize_url(loc.text.strip())
+            if url:
+                lastmods[url] = lastmod.text.strip() if lastmod is not None and lastmod.text else ""
+    return lastmods
+
+########################################################
+# Politeness
+########################################################
+
+class HostThrottle:
+
+    # Spaces out requests to the same host to at most `rate` per second
+    def __init__(self, rate=2.0):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.locks = {}
+        self.last = {}
+
+    async def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        lock = self.locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            delay = self.last.get(host, 0.0) + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.last[host] = time.monotonic()
+
+class RobotsCache:
+
+    # One robots.txt per host, fetched on first use. Unreachable robots.txt allows everything.
+    def __init__(self, http, user_agent):
+        self.http = http
+        self.user_agent = user_agent
+        self.parsers = {}
+        self.locks = {}
+
+    async def allowed(self, url):
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        lock = self.locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            if host not in self.parsers:
+                parser = RobotFileParser()
+                try:
+                    response = await self.http.get(f"{host}/robots.txt")
+                    parser.parse(response.text.splitlines() if response.status_code == 200 else [])
+                except Exception as e:
+                    logging.info(f"Could not read robots.txt for {host}: {e}")
+                    parser.parse([])
+                self.parsers[host] = parser
+        return self.parsers[host].can_fetch(self.user_agent, url)
+
+########################################################
+# Crawler
+########################################################
+
+async def crawl_frontier(seeds, get_links, include, exclude, workers=5, max_links=None, max_depth=None,
+                         throttle=None, robots=None, stats=None):
+
+    # Breadth-first crawl with long-lived workers pulling from one queue,
+    # so a slow page only holds up its own worker.
+    # get_links(url) -> list of absolute links found on the page.
+    # Pages that failed to load are counted in stats["failed"] when a dict is passed.
+    queue = asyncio.Queue()
+    seen = set()
+
+    def enqueue(url, depth):
+        if url is None or url in seen:
+            return
+        if max_links is not None and len(seen) >= max_links:
+            return
+        if not include.match(url) or exclude.match(url):
+            return
+        if max_depth is not None and depth > max_depth:
+            return
+        seen.add(url)
+        queue.put_nowait((url, depth))
+
+    async def worker():
+        while True:
+            url, depth = await queue.get()
+            try:
+                if robots is not None and not await robots.allowed(url):
+                    logging.info(f"Disallowed by robots.txt: {url}")
+                    seen.discard(url)
+                    continue
+                if throttle is not None:
+                    await throttle.wait(url)
+                logging.info(f"Crawling ({len(seen)} seen, {queue.qsize()} queued): {url}")
+                for link in await get_links(url):
+                    enqueue(normalize_url(link), depth + 1)
+            except Exception as e:
+                if stats is not None:
+                    stats["failed"] = stats.get("failed", 0) + 1
+                logging.warning(f"Failed to load {url}: {e}")
+            finally:
+                queue.task_done()
+
+    for seed in seeds:
+        enqueue(normalize_url(seed), 0)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    await queue.join()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    if max_links is not None and len(seen) >= max_links:
+        logging.info(f"Reached max_links={max_links}, stopped adding links.")
+    return seen
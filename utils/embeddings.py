@@ -0,0 +1,230 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+########################################################
+# Configuration
+########################################################
+
+# Read from the environment so scraper.py and app.py always embed with the same model.
+# "onnx" is the all-MiniLM-L6-v2 model Chroma uses by default, so existing vectors stay valid.
+# "sentence-transformers" needs that optional package and a full re-scrape if the model differs.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 lets the runtime pick
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "") == "1"  # int8 weights, needs the onnx package
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+
+MAX_TOKENS = 256  # Same truncation as Chroma's default embedding function, [CLS] and [SEP] included.
+# The scraper sizes chunks from Embedder.max_tokens (this window less the special tokens),
+# so a full chunk is embedded whole; longer documents are truncated with a warning.
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+########################################################
+# Backends
+########################################################
+
+class OnnxBackend:
+
+    # all-MiniLM-L6-v2 on onnxruntime, from the model files Chroma downloads.
+    # Unlike Chroma's function, batches are padded to their longest text instead of 256 tokens,
+    # and texts are sorted by length first so each batch pads as little as possible.
+    def __init__(self, threads=0, quantize=False):
+        self.threads = threads
+        self.quantize = quantize
+        self.name = "onnx/all-MiniLM-L6-v2" + ("-int8" if quantize else "")
+        self.max_tokens = MAX_TOKENS - 2  # Text tokens that fit next to [CLS] and [SEP]
+        self.session = None
+        self.tokenizer = None
+        self.counter = None
+        self._lock = threading.Lock()
+
+    def _model_dir(self):
+        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+        # Reuse Chroma's download and checksum logic for the model files
+        default = ONNXMiniLM_L6_V2()
+        default._download_model_if_not_exists()
+        return os.path.join(default.DOWNLOAD_PATH, default.EXTRACTED_FOLDER_NAME)
+
+    def token_counts(self, texts):
+        # Wordpieces per text without truncation; only the tokenizer is loaded, not the model
+        if self.counter is None:
+            from tokenizers import Tokenizer
+            self.counter = Tokenizer.from_file(os.path.join(self._model_dir(), "tokenizer.json"))
+        return [len(e.ids) for e in self.counter.encode_batch(list(texts), add_special_tokens=False)]
+
+    def _load(self):
+        with self._lock:
+            if self.session is not None:
+                return
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+
+            model_dir = self._model_dir()
+            model_path = os.path.join(model_dir, "model.onnx")
+            if self.quantize:
+                model_path = _quantized_model(model_path)
+
+            tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+            tokenizer.enable_truncation(max_length=MAX_TOKENS)
+            tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+            options = ort.SessionOptions()
+            options.log_severity_level = 3
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.threads:
+                options.intra_op_num_threads = self.threads
+                options.inter_op_num_threads = 1
+            self.tokenizer = tokenizer
+            self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+            logging.info(f"Loaded embedding model {self.name} ({self.threads or 'default'} threads)")
+
+    def encode(self, texts, batch_size=32):
+        self._load()
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encoded = self.tokenizer.encode_batch([texts[i] for i in batch])
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            hidden = self.session.run(None, {
+                "input_ids": input_ids,
+                "attention_mask": attention_mask,
+                "token_type_ids": np.zeros_like(input_ids)
+            })[0]
+            # Mean pooling over real tokens, then L2 normalization (as sentence-transformers does)
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            pooled = (pooled / np.where(norms == 0, 1e-12, norms)).astype(np.float32)
+            for i, vector in zip(batch, pooled):
+                vectors[i] = vector
+        return vectors
+
+class SentenceTransformersBackend:
+
+    # Any sentence-transformers model, on CPU
+    def __init__(self, model_name, threads=0):
+        self.model_name = model_name
+        self.threads = threads
+        self.name = f"sentence-transformers/{model_name}"
+        self.model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self.model is None:
+                import torch
+                from sentence_transformers import SentenceTransformer
+                if self.threads:
+                    torch.set_num_threads(self.threads)
+                self.model = SentenceTransformer(self.model_name, device="cpu")
+                logging.info(f"Loaded embedding model {self.name}")
+
+    @property
+    def max_tokens(self):
+        self._load()
+        return self.model.max_seq_length - 2
+
+    def token_counts(self, texts):
+        self._load()
+        return [len(ids) for ids in self.model.tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+    def encode(self, texts, batch_size=32):
+        self._load()
+        return list(self.model.encode(texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True))
+
+def _quantized_model(model_path):
+
+    # Dynamic int8 quantization of the weights, done once and kept next to the original
+    quantized_path = model_path.replace(".onnx", ".int8.onnx")
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        logging.info(f"Quantizing {model_path} to int8...")
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+    return quantized_path
+
+########################################################
+# Embedder
+########################################################
+
+class Embedder:
+
+    # Explicit embedding layer for ingestion and queries. Documents are encoded in batches,
+    # query texts also go through an LRU cache, since the raw query, its expansion and the
+    # semantic cache lookup often repeat a text that was just encoded.
+    def __init__(self, backend, batch_size=32, cache_size=1024):
+        self.backend = backend
+        self.name = backend.name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.stats = {"hits": 0, "misses": 0}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_tokens(self):
+        return self.backend.max_tokens
+
+    def count_tokens(self, text):
+        # In the model's own tokens, which is what its input window is measured in
+        return self.backend.token_counts([text])[0]
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        texts = list(texts)
+        truncated = sum(1 for n in self.backend.token_counts(texts) if n > self.max_tokens)
+        if truncated:
+            logging.warning(f"{truncated} of {len(texts)} documents exceed {self.max_tokens} tokens, their ends are not embedded")
+        return self.backend.encode(texts, self.batch_size)
+
+    def embed_queries(self, texts):
+        vectors, missing = {}, []
+        with self._lock:
+            for text in texts:
+                if text in self._cache:
+                    self._cache.move_to_end(text)
+                    vectors[text] = self._cache[text]
+                    self.stats["hits"] += 1
+                elif text not in missing:
+                    missing.append(text)
+                    self.stats["misses"] += 1
+        if missing:
+            encoded = self.backend.encode(missing, self.batch_size)
+            with self._lock:
+                for text, vector in zip(missing, encoded):
+                    vectors[text] = vector
+                    self._cache[text] = vector
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return [vectors[text] for text in texts]
+
+def get_embedder(backend=None, model=None, threads=None, quantize=None, batch_size=None, cache_size=None):
+
+    # One embedder per configuration and process, the model loads on first use
+    backend = backend or EMBEDDING_BACKEND
+    model = model or EMBEDDING_MODEL
+    threads = EMBEDDING_THREADS if threads is None else threads
+    quantize = EMBEDDING_QUANTIZE if quantize is None else quantize
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    cache_size = QUERY_CACHE_SIZE if cache_size is None else cache_size
+    key = (backend, model, threads, quantize, batch_size, cache_size)
+    with _embedders_lock:
+        if key not in _embedders:
+            if backend == "onnx":
+                encoder = OnnxBackend(threads=threads, quantize=quantize)
+            elif backend == "sentence-transformers":
+                encoder = SentenceTransformersBackend(model, threads=threads)
+            else:
+                raise ValueError(f"Unknown embedding backend: {backend}")
+            _embedders[key] = Embedder(encoder, batch_size=batch_size, cache_size=cache_size)
+        return _embedders[key]
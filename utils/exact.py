@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+import numpy as np
+
+########################################################
+# Configuration
+########################################################
+
+EXACT_PATH = "./vectors/exact"  # One export per collection: vectors/exact/<collection>/
+EXPORT_BATCH = 1000
+SCORE_BLOCK = 4096  # float16/int8 rows are scored this many at a time, converted to float32 per block
+FORMAT_VERSION = 1
+
+# Files of an export:
+#   manifest.json             collection, count, dim, dtype, space, marker (see content_marker)
+#   embeddings.<dtype>.npy    one row per document (float32, float16 or int8)
+#   scales.npy                per-row scale of int8 rows
+#   norms.npy                 float32 row norms, for cosine and l2 distances
+#   records.jsonl             {"id", "document", "metadata"} per row
+#   offsets.npy               int64 byte offset of each row in records.jsonl, plus the file size
+
+########################################################
+# Export
+########################################################
+
+def quantize(vectors, dtype):
+
+    # float16 halves the footprint; int8 quarters it with one float32 scale per vector
+    if dtype == "float32":
+        return vectors.astype(np.float32), None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.clip(np.abs(vectors).max(axis=1, keepdims=True), 1e-12, None) / 127.0
+        return np.round(vectors / scales).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unsupported dtype: {dtype}")
+
+def dequantize(values, scales=None):
+    vectors = values.astype(np.float32)
+    return vectors * scales if scales is not None else vectors
+
+def export_path(collection_name, root=EXACT_PATH):
+    return os.path.join(root, collection_name)
+
+def content_marker(collection, root=EXACT_PATH):
+
+    # Last write applied to the collection: Chroma's max_seq_id for its metadata segment, which moves
+    # on every add, upsert and delete. Read from chroma.sqlite3 next to the exports' directory;
+    # None without one (e.g. an in-memory client), then only the size is compared.
+    db_path = os.path.join(os.path.dirname(os.path.normpath(root)), "chroma.sqlite3")
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            row = conn.execute(
+                "SELECT MAX(m.seq_id) FROM max_seq_id m JOIN segments s ON s.id = m.segment_id WHERE s.collection = ?",
+                (str(collection.id),)
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row and isinstance(row[0], int) else None
+
+def is_stale(manifest, collection, root=EXACT_PATH):
+    return manifest["count"] != collection.count() or manifest.get("marker") != content_marker(collection, root)
+
+def export_collection(collection, dtype="float32", root=EXACT_PATH):
+
+    # Pages through the collection once, streaming records to disk. Written to a temporary
+    # directory and swapped in, so readers never see a half-written export.
+    # The marker is taken first, a write during the export makes it stale rather than missed.
+    marker = content_marker(collection, root)
+    target = export_path(collection.name, root)
+    staging = f"{target}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(staging, exist_ok=True)
+    space = ((collection.configuration or {}).get("hnsw") or {}).get("space") or \
+        (collection.metadata or {}).get("hnsw:space", "l2")
+
+    chunks, offsets = [], [0]
+    total = collection.count()
+    with open(os.path.join(staging, "records.jsonl"), "wb") as f:
+        for offset in range(0, total, EXPORT_BATCH):
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=EXPORT_BATCH, offset=offset)
+            chunks.append(np.asarray(page["embeddings"], dtype=np.float32))
+            for i, d, m in zip(page["ids"], page["documents"], page["metadatas"]):
+                f.write(json.dumps({"id": i, "document": d, "metadata": m or {}}).encode("utf-8") + b"\n")
+                offsets.append(f.tell())
+    vectors = np.concatenate(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+
+    values, scales = quantize(vectors, dtype)
+    np.save(os.path.join(staging, f"embeddings.{dtype}.npy"), values)
+    if scales is not None:
+        np.save(os.path.join(staging, "scales.npy"), scales)
+    np.save(os.path.join(staging, "norms.npy"), np.linalg.norm(dequantize(values, scales), axis=1).astype(np.float32))
+    np.save(os.path.join(staging, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    manifest = {
+        "format": FORMAT_VERSION,
+        "collection": collection.name,
+        "count": len(vectors),
+        "dim": int(vectors.shape[1]) if len(vectors) else 0,
+        "dtype": dtype,
+        "space": space,
+        "marker": marker,
+        "created": time.time()
+    }
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+    # Open readers keep their memory maps of the old files
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.replace(staging, target)
+    return {
+        "path": target,
+        "documents": len(vectors),
+        "float32_mb": round(vectors.nbytes / 2**20, 2),
+        f"{dtype}_mb": round((values.nbytes + (scales.nbytes if scales is not None else 0)) / 2**20, 2)
+    }
+
+def stamp_export(collection, root=EXACT_PATH):
+    # Marks an export as matching the collection's current state, for exports whose contents are
+    # known to match but were made elsewhere (e.g. unpacked from a snapshot the collection was loaded from)
+    path = os.path.join(export_path(collection.name, root), "manifest.json")
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest["marker"] = content_marker(collection, root)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+
+def drop_export(collection_name, root=EXACT_PATH):
+    # Called when a collection changes or is deleted, the export is rebuilt on next use
+    shutil.rmtree(export_path(collection_name, root), ignore_errors=True)
+
+def read_manifest(collection_name, root=EXACT_PATH):
+    try:
+        with open(os.path.join(export_path(collection_name, root), "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("format") == FORMAT_VERSION else None
+
+########################################################
+# Search
+########################################################
+
+def _matches(metadata, where):
+    # Same filter subset as lexical search: {"key": value}, $eq, $in, $and
+    if "$and" in where:
+        return all(_matches(metadata, w) for w in where["$and"])
+    (key, value), = where.items()
+    if isinstance(value, dict):
+        (op, value), = value.items()
+        if op == "$in":
+            return metadata.get(key) in value
+        if op != "$eq":
+            raise ValueError(f"Unsupported filter operator: {op}")
+    return metadata.get(key) == value
+
+class ExactIndex:
+
+    # Brute-force search over an export, answering like a Chroma collection
+    # (name, count(), query(query_embeddings=..., n_results, where, include)),
+    # so retrieval code can use either. Rows stay memory-mapped in their stored dtype, so a
+    # float16/int8 export also halves/quarters the memory it takes, not just the disk.
+    def __init__(self, collection_name, root=EXACT_PATH):
+        path = export_path(collection_name, root)
+        self.manifest = read_manifest(collection_name, root)
+        if self.manifest is None:
+            raise FileNotFoundError(f"No exact index for '{collection_name}'")
+        self.name = collection_name
+        self.root = root
+        self.space = self.manifest["space"]
+        dtype = self.manifest["dtype"]
+        self.vectors = np.load(os.path.join(path, f"embeddings.{dtype}.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.npy")) if dtype == "int8" else None
+        self.norms = np.load(os.path.join(path, "norms.npy"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self._records = open(os.path.join(path, "records.jsonl"), "rb")
+        self._metadatas = None
+        self._masks = {}
+        self._lock = threading.Lock()
+
+    def count(self):
+        return self.manifest["count"]
+
+    def close(self):
+        self._records.close()
+
+    def is_current(self, collection):
+        # Still the export on disk (not dropped or replaced) and no write to the collection since
+        return read_manifest(self.name, self.root) == self.manifest and not is_stale(self.manifest, collection, self.root)
+
+    def _record(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        # The file position is shared between threads (os.pread would avoid that, but not on Windows)
+        with self._lock:
+            self._records.seek(int(start))
+            line = self._records.read(int(end - start))
+        return json.loads(line)
+
+    def _mask(self, where):
+        # Rows matching a filter, metadata is read once and masks are kept per filter
+        key = json.dumps(where, sort_keys=True)
+        with self._lock:
+            if self._metadatas is None:
+                self._records.seek(0)
+                self._metadatas = [json.loads(line)["metadata"] for line in self._records]
+            if key not in self._masks:
+                self._masks[key] = np.fromiter((_matches(m, where) for m in self._metadatas), dtype=bool, count=self.count())
+            return self._masks[key]
+
+    def _vector(self, row):
+        return dequantize(self.vectors[row], self.scales[row] if self.scales is not None else None)
+
+    def _dots(self, queries):
+        # rows @ queries.T reads the rows in storage order, about twice as fast as queries @ rows.T
+        if self.vectors.dtype == np.float32:
+            return (self.vectors @ queries.T).T
+        # numpy has no float16/int8 BLAS, so blocks are converted (bounded memory, the map stays)
+        # and int8 dot products are rescaled per row
+        dots = np.empty((len(queries), self.count()), dtype=np.float32)
+        for start in range(0, self.count(), SCORE_BLOCK):
+            block = self.vectors[start:start + SCORE_BLOCK].astype(np.float32)
+            dots[:, start:start + len(block)] = (block @ queries.T).T
+        if self.scales is not None:
+            dots *= self.scales[:, 0]
+        return dots
+
+    def _distances(self, queries):
+        # Matches Chroma: l2 is squared euclidean, cosine and ip are 1 - similarity
+        dots = self._dots(queries)
+        if self.space == "cosine":
+            q_norms = np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+            return 1.0 - dots / (q_norms * np.clip(self.norms, 1e-12, None))
+        if self.space == "ip":
+            return 1.0 - dots
+        return np.maximum((queries ** 2).sum(axis=1, keepdims=True) - 2 * dots + self.norms ** 2, 0.0)
+
+    def query(self, query_embeddings=None, n_results=4, where=None, include=("documents", "metadatas", "distances"), query_texts=None):
+        if query_embeddings is None:
+            raise ValueError("ExactIndex needs query_embeddings, pass an embedder to the retrieval functions")
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries.reshape(-1, queries.shape[-1])
+        result = {key: [] for key in ("ids", "documents", "metadatas", "distances", "embeddings")}
+        if not self.count():
+            for key in result:
+                result[key] = [[] for _ in queries]
+            return result
+
+        # One matrix product for the whole batch (raw and expanded query), then top-k per row
+        distances = self._distances(queries)
+        if where:
+            distances = np.where(self._mask(where), distances, np.inf)
+        k = min(n_results, self.count())
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        for row, candidates in zip(distances, top):
+            ranked = [int(i) for i in candidates[np.argsort(row[candidates])] if np.isfinite(row[i])]
+            records = [self._record(i) for i in ranked]
+            result["ids"].append([r["id"] for r in records])
+            result["documents"].append([r["document"] for r in records])
+            result["metadatas"].append([r["metadata"] for r in records])
+            result["distances"].append([float(row[i]) for i in ranked])
+            result["embeddings"].append([self._vector(i) for i in ranked])
+        return {key: value for key, value in result.items() if key == "ids" or key in include}
+
+def open_index(collection, max_documents, dtype="float32", root=EXACT_PATH):
+
+    # Exact search for collections up to max_documents, exporting (again) when there is no
+    # export or the collection was written to since; None means use HNSW.
+    if not max_documents or collection.count() > max_documents:
+        return None
+    manifest = read_manifest(collection.name, root)
+    if manifest is None or is_stale(manifest, collection, root):
+        export_collection(collection, manifest["dtype"] if manifest else dtype, root)
+    return ExactIndex(collection.name, root)
@@ -0,0 +1,282 @@
+import re
+import logging
+import importlib.util
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+
+########################################################
+# Configuration
+########################################################
+
+# HTTP/2 needs the optional h2 package, otherwise pooled HTTP/1.1 keep-alive is used
+HTTP2 = importlib.util.find_spec("h2") is not None
+USER_AGENT = "Mozilla/5.0 (compatible; DocsReader/1.0)"
+
+HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+SKIPPED = {"script", "style", "noscript", "template", "svg", "button"}
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "li", "ul", "ol", "dl", "dt", "dd", "table", "thead",
+    "tbody", "tr", "td", "th", "blockquote", "figure", "figcaption", "header", "footer", "aside", "br", "hr"
+}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+# Page types for metadata-filtered retrieval, matched against URL path segments and breadcrumbs
+API_HINTS = {"api", "reference", "generated", "autoapi", "modules", "_autosummary"}
+GUIDE_HINTS = {
+    "tutorial", "tutorials", "guide", "guides", "user_guide", "user-guide", "getting_started", "getting-started",
+    "quickstart", "howto", "how-to", "examples", "gallery", "cookbook", "learn"
+}
+VERSION_SEGMENT = re.compile(r"^(v?\d+(\.\d+)+|stable|latest|dev|main)$")
+VERSION_META = {"docsearch:version", "version", "docs:version"}
+
+########################################################
+# Utility Functions
+########################################################
+
+def create_http_client(concurrency=10, timeout=20):
+
+    # One pooled client per run, connections are kept alive across pages
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        timeout=timeout,
+        follow_redirects=True,
+        headers={"User-Agent": USER_AGENT},
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    )
+
+def parse_selector(selector):
+
+    # Supports the compound selectors used in libraries.yaml: tag, #id, .class and [attr='value']
+    # (e.g. "article[role='main']#furo-main-content"), but no combinators
+    tag = re.match(r"^[a-zA-Z][\w-]*", selector)
+    return {
+        "tag": tag.group(0).lower() if tag else None,
+        "id": next(iter(re.findall(r"#([\w-]+)", selector)), None),
+        "classes": set(re.findall(r"\.([\w-]+)", selector)),
+        "attrs": {k: v for k, _, v in re.findall(r"\[([\w-]+)=(['\"]?)(.*?)\2\]", selector)}
+    }
+
+def _matches(parsed, tag, attrs):
+    if parsed["tag"] and parsed["tag"] != tag:
+        return False
+    if parsed["id"] and attrs.get("id") != parsed["id"]:
+        return False
+    if parsed["classes"] and not parsed["classes"] <= set((attrs.get("class") or "").split()):
+        return False
+    return all(attrs.get(k) == v for k, v in parsed["attrs"].items())
+
+class _BlockParser(HTMLParser):
+
+    # Produces the same heading/code/text blocks as EXTRACT_BLOCKS_JS in components.py,
+    # from the first element matching the selector
+    def __init__(self, selector):
+        super().__init__(convert_charrefs=True)
+        self.selector = parse_selector(selector)
+        self.blocks = []
+        self.stack = []  # Open elements inside the match as (tag, section id), empty means outside
+        self.done = False
+        self.skip = 0
+        self.pre = 0
+        self.heading = None
+        self.level = 0
+        self.buffer = []
+        self.anchor = ""
+        self.section = ""
+
+    def _flush(self, kind="text"):
+        text = "".join(self.buffer)
+        self.buffer = []
+        if kind != "code":
+            text = re.sub(r"[ \t\r\f\v]+", " ", text)
+            text = re.sub(r" *\n *", "\n", text).strip()
+        if text.strip():
+            self.blocks.append({"type": kind, "text": text, "anchor": self.anchor, "section": self.section})
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = dict(attrs)
+        if not self.stack:
+            if _matches(self.selector, tag, attrs):
+                self.stack.append((tag, attrs.get("id")))
+            return
+        if tag not in VOID_TAGS:
+            self.stack.append((tag, attrs.get("id") if tag in ("section", "div") else None))
+        if self.skip or tag in SKIPPED:
+            if tag in SKIPPED and tag not in VOID_TAGS:
+                self.skip += 1
+            return
+        if tag in HEADINGS:
+            self._flush()
+            self.heading = attrs.get("id") or next((i for _, i in reversed(self.stack[:-1]) if i), "")
+            self.level = int(tag[1])
+        elif tag == "pre":
+            self._flush()
+            self.pre += 1
+        elif tag == "br":
+            self.buffer.append("\n")
+        elif tag in BLOCK_TAGS and not self.pre and self.heading is None:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if self.done or not self.stack or tag in VOID_TAGS:
+            return
+        if tag not in (t for t, _ in self.stack):
+            return  # Stray end tag
+        # Close implicitly ended elements too (e.g. unclosed <p> or <li>)
+        while self.stack:
+            closed, _ = self.stack.pop()
+            self._close(closed)
+            if closed == tag:
+                break
+        if not self.stack:
+            self._flush()
+            self.done = True
+
+    def _close(self, tag):
+        if tag in SKIPPED and self.skip:
+            self.skip -= 1
+            return
+        if self.skip:
+            return
+        if tag in HEADINGS and self.heading is not None:
+            # Drop Sphinx/MkDocs permalink markers from the section title
+            title = re.sub(r"\s+", " ", "".join(self.buffer)).strip()
+            title = re.sub(r"[\u00b6#]\s*$", "", title).strip()
+            self.buffer = []
+            self.anchor, self.section, self.heading = self.heading, title, None
+            if title:
+                self.blocks.append({
+                    "type": "heading", "text": title, "anchor": self.anchor, "section": title, "level": self.level
+                })
+        elif tag == "pre" and self.pre:
+            self.pre -= 1
+            self._flush("code")
+        elif tag in BLOCK_TAGS and not self.pre and self.heading is None:
+            self._flush()
+
+    def handle_data(self, data):
+        if self.stack and not self.done and not self.skip:
+            self.buffer.append(data)
+
+def extract_blocks(html, selector):
+    parser = _BlockParser(selector)
+    parser.feed(html)
+    parser.close()
+    return parser.blocks
+
+class _PageMetaParser(HTMLParser):
+
+    # Reads <title>, version <meta> tags and the breadcrumb trail of a whole page
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = []
+        self.in_title = False
+        self.meta = {}
+        self.crumbs = []
+        self.crumb_depth = 0  # Open elements inside the breadcrumb container, 0 means outside
+        self.crumb_item = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "title":
+            self.in_title = True
+        elif tag == "meta":
+            key = (attrs.get("name") or attrs.get("property") or "").lower()
+            if key and attrs.get("content"):
+                self.meta.setdefault(key, attrs["content"].strip())
+        if self.crumb_depth:
+            if tag not in VOID_TAGS:
+                self.crumb_depth += 1
+            if tag in ("li", "a") and self.crumb_item is None:
+                self.crumb_item = (tag, [])
+            return
+        marker = f"{attrs.get('class') or ''} {attrs.get('aria-label') or ''} {attrs.get('id') or ''}".lower()
+        if not self.crumbs and "breadcrumb" in marker and tag not in VOID_TAGS:
+            self.crumb_depth = 1
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self.in_title = False
+        if not self.crumb_depth:
+            return
+        if self.crumb_item and self.crumb_item[0] == tag:
+            text = re.sub(r"\s+", " ", "".join(self.crumb_item[1])).strip(" \u00bb\u203a>/|")
+            if text:
+                self.crumbs.append(text)
+            self.crumb_item = None
+        self.crumb_depth -= 1
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title.append(data)
+        if self.crumb_item:
+            self.crumb_item[1].append(data)
+
+def page_type(url, breadcrumb=""):
+
+    # "api" for reference pages, "guide" for tutorials and user guides, "docs" for the rest
+    segments = {s.lower() for s in urlsplit(url).path.split("/") if s}
+    segments |= {c.strip().lower().replace(" ", "-") for c in breadcrumb.split(">")}
+    words = {w for s in segments for w in re.split(r"[-_.]", s)} | segments
+    if words & API_HINTS:
+        return "api"
+    if words & GUIDE_HINTS:
+        return "guide"
+    return "docs"
+
+def extract_page_meta(html, url):
+
+    # Page-level metadata stored on every chunk of the page: title, breadcrumb, version and page type
+    parser = _PageMetaParser()
+    parser.feed(html)
+    parser.close()
+    title = re.sub(r"\s+", " ", "".join(parser.title)).strip()
+    # Drop the site name suffix, e.g. "Image Module - Pillow (PIL Fork) 11.0.0 documentation"
+    title = re.split(r"\s+[\u2014\u2013|\-\u00b7]\s+", title)[0] if title else parser.meta.get("og:title", "")
+    breadcrumb = " > ".join(parser.crumbs)
+
+    version = next((parser.meta[k] for k in VERSION_META if parser.meta.get(k)), "")
+    if not version:
+        # Sphinx keeps the release in its documentation options
+        found = re.search(r"VERSION:\s*['\"]([^'\"]+)['\"]", html)
+        version = found.group(1) if found else ""
+    if not version:
+        version = next((s for s in urlsplit(url).path.split("/") if VERSION_SEGMENT.match(s)), "")
+    return {"title": title, "breadcrumb": breadcrumb, "version": version, "doc_type": page_type(url, breadcrumb)}
+
+class _LinkParser(HTMLParser):
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "base":
+            self.base_url = urljoin(self.base_url, dict(attrs).get("href") or "")
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            if href and not href.startswith(("javascript:", "mailto:", "tel:")):
+                self.links.append(urljoin(self.base_url, href))
+
+def extract_links(html, base_url):
+    parser = _LinkParser(base_url)
+    parser.feed(html)
+    parser.close()
+    return parser.links
+
+async def fetch_html(http, url):
+
+    # Returns (html, etag, final url), or (None, "", url) when the page isn't plain HTML.
+    # Relative links resolve against the final url, redirects (e.g. /page -> /page/) are followed.
+    try:
+        response = await http.get(url)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logging.info(f"HTTP fetch failed for {url}: {e}")
+        return None, "", url
+    if "html" not in response.headers.get("content-type", ""):
+        return None, "", str(response.url)
+    return response.text, response.headers.get("etag", ""), str(response.url)
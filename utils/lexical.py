@@ -0,0 +1,120 @@
+import os
+import re
+import json
+import sqlite3
+
+########################################################
+# Configuration
+########################################################
+
+LEXICAL_PATH = "./vectors/lexical.sqlite3"
+
+########################################################
+# Utility Functions
+########################################################
+
+# SQLite FTS5 index kept next to chroma.sqlite3, one row per chunk.
+# Rows are keyed by collection name, so each blue/green version has its own rows.
+# Underscores are kept inside tokens so identifiers like get_collection stay whole.
+# FTS5 columns can't be indexed, so chunk_keys maps (collection, id) to the FTS rowid;
+# updates and deletes go through it instead of scanning every library's chunks.
+
+def open_index(path=LEXICAL_PATH):
+    # Parallel library runs write from several connections, wait on locks instead of failing
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+        "id UNINDEXED, collection UNINDEXED, metadata UNINDEXED, document, "
+        "tokenize = \"unicode61 tokenchars '_'\")"
+    )
+    with conn:
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunk_keys'").fetchone()
+        if not exists:
+            conn.execute(
+                "CREATE TABLE chunk_keys (collection TEXT, id TEXT, chunk_rowid INTEGER, "
+                "PRIMARY KEY (collection, id)) WITHOUT ROWID"
+            )
+            # Index files written before chunk_keys existed
+            conn.execute("INSERT OR REPLACE INTO chunk_keys SELECT collection, id, rowid FROM chunks")
+    return conn
+
+def _delete_rows(conn, collection_name, ids):
+    keys = [(collection_name, i) for i in ids]
+    rowids = [row for key in keys for row in conn.execute(
+        "SELECT chunk_rowid FROM chunk_keys WHERE collection = ? AND id = ?", key
+    )]
+    conn.executemany("DELETE FROM chunks WHERE rowid = ?", rowids)
+    conn.executemany("DELETE FROM chunk_keys WHERE collection = ? AND id = ?", keys)
+
+def add_documents(conn, collection_name, ids, documents, metadatas, fresh=False):
+
+    # Upsert: FTS5 has no primary key, so replace by deleting first.
+    # fresh=True skips that for a collection being built from scratch, where no id exists yet.
+    with conn:
+        if not fresh:
+            _delete_rows(conn, collection_name, ids)
+        for i, d, m in zip(ids, documents, metadatas):
+            rowid = conn.execute(
+                "INSERT INTO chunks (id, collection, metadata, document) VALUES (?, ?, ?, ?)",
+                (i, collection_name, json.dumps(m or {}), d)
+            ).lastrowid
+            conn.execute("INSERT OR REPLACE INTO chunk_keys VALUES (?, ?, ?)", (collection_name, i, rowid))
+
+def delete_documents(conn, collection_name, ids):
+    with conn:
+        _delete_rows(conn, collection_name, ids)
+
+def drop_collection(conn, collection_name):
+    with conn:
+        conn.execute(
+            "DELETE FROM chunks WHERE rowid IN (SELECT chunk_rowid FROM chunk_keys WHERE collection = ?)",
+            (collection_name,)
+        )
+        conn.execute("DELETE FROM chunk_keys WHERE collection = ?", (collection_name,))
+
+def _match_expression(query):
+
+    # OR together quoted terms, quoting escapes FTS5 syntax and turns
+    # dotted names like Image.thumbnail into phrase matches
+    terms = [t for t in re.findall(r"[\w.]+", query) if len(t.strip(".")) > 1]
+    return " OR ".join('"' + t.strip(".") + '"' for t in dict.fromkeys(terms))
+
+def _where_clause(where):
+
+    # Translates the Chroma `where` filters used for routing ({"key": value}, $eq, $in, $and)
+    # into SQL on the stored metadata JSON
+    if "$and" in where:
+        parts = [_where_clause(w) for w in where["$and"]]
+        return " AND ".join(f"({sql})" for sql, _ in parts), [p for _, params in parts for p in params]
+    (key, value), = where.items()
+    if isinstance(value, dict):
+        (op, value), = value.items()
+        if op == "$in":
+            return f"json_extract(metadata, ?) IN ({', '.join('?' * len(value))})", ["$." + key, *value]
+        if op != "$eq":
+            raise ValueError(f"Unsupported filter operator: {op}")
+    return "json_extract(metadata, ?) = ?", ["$." + key, value]
+
+def search(collection_name, query, n_results=4, path=LEXICAL_PATH, where=None):
+
+    # Same hit shape as retrieval.query_collection, distance is the bm25 score (lower is better)
+    expression = _match_expression(query)
+    if not expression or not os.path.exists(path):
+        return []
+    condition, params = _where_clause(where) if where else ("1", [])
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT id, document, metadata, bm25(chunks) AS score FROM chunks "
+            f"WHERE chunks MATCH ? AND collection = ? AND {condition} ORDER BY score LIMIT ?",
+            (expression, collection_name, *params, n_results)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+    return [
+        {"id": i, "document": d, "metadata": json.loads(m), "distance": score}
+        for i, d, m, score in rows
+    ]
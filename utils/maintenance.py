@@ -0,0 +1,217 @@
+import os
+import time
+import struct
+import sqlite3
+import numpy as np
+from aliases import resolve_collection, promote_collection, next_version_name
+from lexical import open_index, add_documents
+from exact import quantize, dequantize, export_collection
+
+########################################################
+# Configuration
+########################################################
+
+# Settings compared by the tuning report, as Chroma hnsw configuration keys
+CANDIDATE_SETTINGS = [
+    {"max_neighbors": 16, "ef_construction": 100, "ef_search": 100},
+    {"max_neighbors": 16, "ef_construction": 200, "ef_search": 50},
+    {"max_neighbors": 32, "ef_construction": 200, "ef_search": 100},
+    {"max_neighbors": 8, "ef_construction": 100, "ef_search": 40},
+]
+QUANTIZED_DIR = "exact"  # vectors/exact/<collection>/, the exact search exports
+COPY_BATCH = 1000
+
+########################################################
+# Footprint
+########################################################
+
+def read_hnsw_header(segment_dir):
+
+    # header.bin of Chroma's hnswlib: u32 version, then the hnswlib index header fields
+    path = os.path.join(segment_dir, "header.bin")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        data = f.read(100)
+    if len(data) < 100:
+        return None
+    (_, _, max_elements, elements, size_per_element, _, _, _, _, max_m, max_m0, m, _, ef_construction) = struct.unpack(
+        "<IQQQQQQiIQQQdQ", data
+    )
+    return {
+        "max_elements": max_elements,
+        "elements": elements,
+        "size_per_element": size_per_element,
+        "max_neighbors": m,
+        "ef_construction": ef_construction
+    }
+
+def vector_segments(vector_path):
+
+    # collection name -> HNSW segment directory name
+    database = sqlite3.connect(os.path.join(vector_path, "chroma.sqlite3"))
+    try:
+        rows = database.execute(
+            "SELECT c.name, s.id FROM segments s JOIN collections c ON s.collection = c.id WHERE s.scope = 'VECTOR'"
+        ).fetchall()
+    finally:
+        database.close()
+    return dict(rows)
+
+def _dir_size(path):
+    if not os.path.isdir(path):
+        return 0
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+def footprint(CLIENT, vector_path):
+
+    # Per collection: live documents vs elements in the HNSW graph. Deleted documents stay in the
+    # graph as tombstones (fragmentation) until the index is rebuilt. Documents below Chroma's
+    # sync_threshold are still in the write log, not yet in the graph (unsynced).
+    segments = vector_segments(vector_path)
+    report = []
+    for collection in sorted(CLIENT.list_collections(), key=lambda c: c.name):
+        segment_dir = os.path.join(vector_path, segments.get(collection.name, ""))
+        header = read_hnsw_header(segment_dir) if collection.name in segments else None
+        live = collection.count()
+        elements = header["elements"] if header else 0
+        hnsw = (collection.configuration or {}).get("hnsw") or {}
+        report.append({
+            "collection": collection.name,
+            "live": live,
+            "indexed": elements,
+            "deleted": max(elements - live, 0),
+            "unsynced": max(live - elements, 0),
+            "fragmentation": round(max(elements - live, 0) / elements, 3) if elements else 0.0,
+            "capacity": header["max_elements"] if header else 0,
+            "memory_mb": round(header["max_elements"] * header["size_per_element"] / 2**20, 2) if header else 0.0,
+            "disk_mb": round(_dir_size(segment_dir) / 2**20, 2) if collection.name in segments else 0.0,
+            "max_neighbors": hnsw.get("max_neighbors"),
+            "ef_construction": hnsw.get("ef_construction"),
+            "ef_search": hnsw.get("ef_search")
+        })
+    return report
+
+########################################################
+# Tuning
+########################################################
+
+def load_embeddings(collection, include=("embeddings",)):
+
+    # Everything stored in a collection, read in pages
+    stored = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    total = collection.count()
+    for offset in range(0, total, COPY_BATCH):
+        page = collection.get(include=list(include), limit=COPY_BATCH, offset=offset)
+        stored["ids"].extend(page["ids"])
+        for key in include:
+            stored[key].extend(page[key])
+    stored["embeddings"] = np.asarray(stored["embeddings"], dtype=np.float32)
+    return stored
+
+def _sample_queries(vectors, n_queries, seed=0):
+
+    # Stored vectors with a little noise, so queries aren't exact copies of documents
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+    noisy = picked + rng.normal(0, 0.02, picked.shape).astype(np.float32)
+    return noisy / np.linalg.norm(noisy, axis=1, keepdims=True)
+
+def _exact_top_k(vectors, queries, k):
+    normalized = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    scores = queries @ normalized.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def evaluate_settings(ids, vectors, space="cosine", settings=None, n_queries=100, k=10):
+
+    # Builds a throwaway in-memory index per setting and measures recall@k against exact search
+    import chromadb
+    settings = settings or CANDIDATE_SETTINGS
+    queries = _sample_queries(vectors, n_queries)
+    truth = _exact_top_k(vectors, queries, k)
+    client = chromadb.EphemeralClient()
+    report = []
+    for i, setting in enumerate(settings):
+        name = f"tuning_{i}"
+        build_start = time.perf_counter()
+        # sync_threshold low enough that every vector goes into the graph
+        collection = client.create_collection(name, configuration={"hnsw": {"space": space, "sync_threshold": 100, **setting}})
+        for start in range(0, len(ids), COPY_BATCH):
+            collection.add(ids=ids[start:start + COPY_BATCH], embeddings=vectors[start:start + COPY_BATCH])
+        build_s = time.perf_counter() - build_start
+
+        latencies, recalls = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = collection.query(query_embeddings=[query], n_results=k, include=[])["ids"][0]
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len({ids[j] for j in expected} & set(found)) / len(expected))
+        client.delete_collection(name)
+        report.append({
+            **setting,
+            f"recall@{k}": round(float(np.mean(recalls)), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+            "build_s": round(build_s, 2)
+        })
+    return report
+
+def rebuild_collection(CLIENT, name, setting, vector_path, library=None):
+
+    # Copies documents, metadata and embeddings (no re-embedding) into a new version with the
+    # given HNSW settings, which leaves the deleted-element tombstones behind.
+    # If the collection is live for a library, the copy is promoted in its place.
+    source = CLIENT.get_collection(name=name)
+    hnsw = (source.configuration or {}).get("hnsw") or {}
+    stored = load_embeddings(source, include=("embeddings", "documents", "metadatas"))
+    if library is None:
+        # Version names look like <library>_docs__v<n>, legacy ones like <library>_docs
+        library = name.split("__v")[0][:-len("_docs")] if "_docs" in name else None
+    target_name = next_version_name(CLIENT, library) if library else f"{name}__rebuilt"
+    target = CLIENT.create_collection(
+        name=target_name,
+        metadata={**(source.metadata or {}), "rebuilt_from": name},
+        configuration={"hnsw": {"space": hnsw.get("space", "l2"), **setting}}
+    )
+    lexical = open_index(os.path.join(vector_path, "lexical.sqlite3"))
+    for start in range(0, len(stored["ids"]), COPY_BATCH):
+        end = start + COPY_BATCH
+        target.add(
+            ids=stored["ids"][start:end],
+            embeddings=stored["embeddings"][start:end],
+            documents=stored["documents"][start:end],
+            metadatas=stored["metadatas"][start:end]
+        )
+        add_documents(lexical, target_name, stored["ids"][start:end], stored["documents"][start:end], stored["metadatas"][start:end], fresh=True)
+    lexical.close()
+    if target.count() != source.count():
+        raise RuntimeError(f"Copied {target.count()} of {source.count()} documents into '{target_name}'")
+    if library and resolve_collection(library, vector_path) == name:
+        promote_collection(library, target_name, vector_path)
+    return target_name
+
+def set_ef_search(collection, ef_search):
+
+    # ef_search is a query-time setting, it changes without a rebuild
+    collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+
+########################################################
+# Quantization
+########################################################
+
+def quantized_recall(vectors, dtype, n_queries=100, k=10):
+
+    # How much exact search over the quantized copy agrees with float32
+    queries = _sample_queries(vectors, n_queries)
+    truth = _exact_top_k(vectors, queries, k)
+    values, scales = quantize(vectors, dtype)
+    found = _exact_top_k(dequantize(values, scales), queries, k)
+    return round(float(np.mean([len(set(t) & set(f)) / k for t, f in zip(truth, found)])), 4)
+
+def write_quantized_copy(collection, dtype, vector_path):
+
+    # The collection's exact search export, stored as <dtype> (see exact.export_collection)
+    result = export_collection(collection, dtype, os.path.join(vector_path, QUANTIZED_DIR))
+    stored = load_embeddings(collection)
+    result["recall@10"] = quantized_recall(stored["embeddings"], dtype) if len(stored["ids"]) >= 10 else None
+    return result
@@ -3,10 +3,19 @@ from itertools import zip_longest
 import shutil
 import sqlite3
 import os
+import re
+from aliases import load_aliases, prune_versions
+from lexical import open_index, add_documents, drop_collection
+from exact import drop_export
+from telemetry import load_traces, summarize
+from maintenance import footprint, load_embeddings, evaluate_settings, rebuild_collection, set_ef_search, write_quantized_copy, CANDIDATE_SETTINGS
 
 VECTOR_PATH = "./vectors"
 CLIENT = chromadb.PersistentClient(path=VECTOR_PATH)
 
+# Segment directories are UUIDs, anything else in ./vectors (e.g. exact/) is ours
+SEGMENT_DIR = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
 def show_collections():
     collections = CLIENT.list_collections()
     print(f"\nExpected number of collections: {len(collections)}")
@@ -22,7 +31,7 @@ def compare_ids():
         return [id[0] for id in ids]
 
     ids = sorted(get_ids(os.path.join(VECTOR_PATH, "chroma.sqlite3")))
-    files = sorted([f for f in os.listdir(VECTOR_PATH) if not f.endswith(".sqlite3")])
+    files = sorted([f for f in os.listdir(VECTOR_PATH) if os.path.isdir(os.path.join(VECTOR_PATH, f)) and SEGMENT_DIR.match(f)])
     print("\nExpected VS Actual collection names:")
     for expected, actual in zip_longest(ids, files, fillvalue="MISSING"):
         print(f"[{expected}, {actual}]")
@@ -35,7 +44,7 @@ def prune_unexisting():
                 elements.remove(el)
         for el in elements:
             full_path = os.path.join(path, el)
-            if el not in ids and os.path.isdir(full_path):
+            if el not in ids and os.path.isdir(full_path) and SEGMENT_DIR.match(el):
                 shutil.rmtree(full_path)
 
     def get_ids(path):
@@ -62,15 +71,126 @@ def inspect_collection():
     print(results['documents'][0])
     print(results['metadatas'][0])
 
+def _delete(name):
+    CLIENT.delete_collection(name)
+    lexical = open_index()
+    drop_collection(lexical, name)
+    lexical.close()
+    drop_export(name, os.path.join(VECTOR_PATH, "exact"))
+    print(f"Collection '{name}' deleted.")
+
 def delete_collection():
     name = input("Enter collection name to delete: ")
     confirm = input(f"Are you sure you want to delete '{name}'? (y/n): ")
     if confirm.lower() == "y":
-        CLIENT.delete_collection(name)
-        print(f"Collection '{name}' deleted.")
+        _delete(name)
+    else:
+        print("Operation cancelled.")
+
+def delete_rebuilt(name, target):
+    # Option 6 keeps the version that was live before as the rollback target, which after a
+    # rebuild is the old copy itself, so it is offered for deletion here instead
+    print(f"Rebuilt into '{target}'.")
+    confirm = input(f"Delete the old version '{name}' now (otherwise it is kept for rollback)? (y/n): ")
+    if confirm.lower() == "y":
+        _delete(name)
+
+def prune_old_versions():
+    aliases = load_aliases(VECTOR_PATH)
+    print("\nLive collections:")
+    print("\n".join(f"{library} -> {name}" for library, name in sorted(aliases.items())) or "None")
+    confirm = input("Delete versions older than the live one per library, except the previously live one? (y/n): ")
+    if confirm.lower() == "y":
+        lexical = open_index()
+        for library in sorted(aliases):
+            for name in prune_versions(CLIENT, library, keep=1, path=VECTOR_PATH):
+                drop_collection(lexical, name)
+                drop_export(name, os.path.join(VECTOR_PATH, "exact"))
+                print(f"Collection '{name}' deleted.")
+        lexical.close()
+        print("Run option 3 to prune the leftover segment directories.")
     else:
         print("Operation cancelled.")
 
+def build_lexical_index():
+    name = input("Enter collection name to index: ")
+    collection = CLIENT.get_collection(name=name)
+    stored = collection.get(include=["documents", "metadatas"])
+    lexical = open_index()
+    drop_collection(lexical, name)
+    add_documents(lexical, name, stored["ids"], stored["documents"], stored["metadatas"], fresh=True)
+    lexical.close()
+    print(f"Indexed {len(stored['ids'])} documents from '{name}'.")
+
+def show_request_stats():
+    since = input("Only include requests since (YYYY-MM-DD, blank for all): ").strip() or None
+    summary = summarize(load_traces(since=since))
+    print(f"\nRequests: {summary['requests']}")
+    if summary["cache_hit_rate"] is not None:
+        print(f"Cache hit rate: {summary['cache_hit_rate']:.1%}")
+    print(f"\n{'Stage':<22}{'Count':>8}{'Mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for name, stats in sorted(summary["spans"].items(), key=lambda item: -item[1]["mean_ms"]):
+        print(f"{name:<22}{stats['count']:>8}{stats['mean_ms']:>10}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    if summary["tokens"]:
+        print("\nMean tokens:")
+        print("\n".join(f"{name}: {value}" for name, value in sorted(summary["tokens"].items())))
+
+def show_index_footprint():
+    report = footprint(CLIENT, VECTOR_PATH)
+    print(f"\n{'Collection':<32}{'Live':>8}{'Indexed':>9}{'Deleted':>9}{'Unsynced':>10}{'Frag':>7}{'Mem MB':>8}{'Disk MB':>9}  M/efC/efS")
+    for r in report:
+        print(
+            f"{r['collection']:<32}{r['live']:>8}{r['indexed']:>9}{r['deleted']:>9}{r['unsynced']:>10}"
+            f"{r['fragmentation']:>7.1%}{r['memory_mb']:>8}{r['disk_mb']:>9}  "
+            f"{r['max_neighbors']}/{r['ef_construction']}/{r['ef_search']}"
+        )
+    print(f"\nTotal: {sum(r['memory_mb'] for r in report):.1f} MB in memory when loaded, {sum(r['disk_mb'] for r in report):.1f} MB on disk")
+    print("Rebuild collections with high fragmentation using option 11.")
+
+def tune_collection():
+    name = input("Enter collection name to tune: ")
+    collection = CLIENT.get_collection(name=name)
+    space = ((collection.configuration or {}).get("hnsw") or {}).get("space", "l2")
+    stored = load_embeddings(collection)
+    if len(stored["ids"]) < 20:
+        print("Too few documents to tune.")
+        return
+    print(f"\nEvaluating {len(CANDIDATE_SETTINGS)} settings on {len(stored['ids'])} vectors (exact search is the reference)...")
+    report = evaluate_settings(stored["ids"], stored["embeddings"], space=space)
+    print(f"\n{'#':<3}{'M':>4}{'efC':>6}{'efS':>6}{'Recall@10':>11}{'p50 ms':>9}{'p95 ms':>9}{'Build s':>9}")
+    for i, r in enumerate(report, start=1):
+        print(f"{i:<3}{r['max_neighbors']:>4}{r['ef_construction']:>6}{r['ef_search']:>6}{r['recall@10']:>11}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['build_s']:>9}")
+
+    choice = input("\nApply a setting? Enter its number (blank to cancel): ").strip()
+    if not choice.isdigit() or not 1 <= int(choice) <= len(report):
+        print("Operation cancelled.")
+        return
+    setting = CANDIDATE_SETTINGS[int(choice) - 1]
+    current = (collection.configuration or {}).get("hnsw") or {}
+    if all(current.get(k) == setting[k] for k in ("max_neighbors", "ef_construction")):
+        # Only the query-time setting differs, no rebuild needed
+        set_ef_search(collection, setting["ef_search"])
+        print(f"Set ef_search={setting['ef_search']} on '{name}'.")
+        return
+    confirm = input(f"Rebuild '{name}' with {setting} (documents are copied, not re-embedded)? (y/n): ")
+    if confirm.lower() == "y":
+        delete_rebuilt(name, rebuild_collection(CLIENT, name, setting, VECTOR_PATH))
+    else:
+        print("Operation cancelled.")
+
+def rebuild_index():
+    name = input("Enter collection name to compact: ")
+    collection = CLIENT.get_collection(name=name)
+    current = (collection.configuration or {}).get("hnsw") or {}
+    setting = {k: current[k] for k in ("max_neighbors", "ef_construction", "ef_search") if k in current}
+    delete_rebuilt(name, rebuild_collection(CLIENT, name, setting, VECTOR_PATH))
+
+def store_quantized_copy():
+    name = input("Enter collection name: ")
+    dtype = input("Store as (float32/float16/int8): ").strip()
+    result = write_quantized_copy(CLIENT.get_collection(name=name), dtype, VECTOR_PATH)
+    print("\n".join(f"{k}: {v}" for k, v in result.items()))
+
 menu = """
 Choose an option:
 1. Show all collections
@@ -78,6 +198,13 @@ Choose an option:
 3. Prune unexisting collections
 4. Inspect a collection
 5. Delete a collection
+6. Remove old collection versions
+7. Build lexical index for a collection
+8. Show request latency stats
+9. Show index footprint and fragmentation
+10. Tune a collection's HNSW settings (recall vs latency)
+11. Compact a collection's index (rebuild without deleted entries)
+12. Export a collection for exact search (float32/float16/int8 copy)
 
 Enter choice: """
 
@@ -93,6 +220,20 @@ elif choice == "4":
     inspect_collection()
 elif choice == "5":
     delete_collection()
+elif choice == "6":
+    prune_old_versions()
+elif choice == "7":
+    build_lexical_index()
+elif choice == "8":
+    show_request_stats()
+elif choice == "9":
+    show_index_footprint()
+elif choice == "10":
+    tune_collection()
+elif choice == "11":
+    rebuild_index()
+elif choice == "12":
+    store_quantized_copy()
 else:
     print("Invalid choice.")
     
@@ -0,0 +1,388 @@
+import re
+import time
+import asyncio
+import logging
+import threading
+import numpy as np
+from contextlib import contextmanager
+
+########################################################
+# Configuration
+########################################################
+
+TOKEN_ENCODING = "o200k_base"  # gpt-4o / gpt-4o-mini
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# Query routing: cheap patterns that scope a search to part of the docs (see classify_query)
+API_QUERY = re.compile(
+    r"\b(parameters?|arguments?|kwargs|signature|return (type|value)|attributes?|methods?|api|reference|"
+    r"deprecated|raises?|dtype|default value)\b|\w\.\w+\(|\w\(\)",
+    re.IGNORECASE
+)
+GUIDE_QUERY = re.compile(
+    r"\b(how (do|can|should|to)|tutorial|guide|walk ?through|step[- ]by[- ]step|get(ting)? started|"
+    r"best practices?|explain|what is the difference|when should)\b",
+    re.IGNORECASE
+)
+CODE_QUERY = re.compile(r"\b(code (example|sample|snippet)s?|snippets?|show me (the )?code)\b", re.IGNORECASE)
+VERSION_QUERY = re.compile(r"\b(?:version|v)\s?(\d+(?:\.\d+)+)\b", re.IGNORECASE)
+
+_encoding = None
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+########################################################
+# Utility Functions
+########################################################
+
+def _get_encoding():
+
+    # tiktoken is optional and fetches its vocabulary on first use, so fall back quietly
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            logging.info(f"tiktoken unavailable, estimating token counts: {e}")
+            _encoding = False
+    return _encoding
+
+def count_tokens(text):
+    
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Rough BPE-like estimate: words and punctuation each count as one token
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+def count_message_tokens(messages):
+
+    # Chat messages carry a few tokens of framing each on top of their content
+    return sum(count_tokens(m["content"]) + 4 for m in messages)
+
+def expansion_messages(query, library_name):
+
+    return [
+        {"role": "system", "content": f"You are a knowledgeable developer in a Python library/tool called {library_name}. First, paraphrase the user query twice, then followed by answering in 2 short and concise sentences without any code."},
+        {"role": "user", "content": query}
+    ]
+
+def expand_query(OPENAI_CLIENT, query, library_name, model):
+    
+    response = OPENAI_CLIENT.chat.completions.create(
+        model=model,
+        messages=expansion_messages(query, library_name),
+    )
+    
+    ai_response = response.choices[0].message.content.strip()
+
+    return f"{query} {ai_response}"
+
+def _query_args(queries, embedder=None):
+
+    # With an embedder the texts are encoded here (and cached), otherwise by Chroma
+    if embedder is not None:
+        return {"query_embeddings": embedder.embed_queries(queries)}
+    return {"query_texts": queries}
+
+def query_collection(collection, queries, n_results=4, embedder=None, where=None):
+
+    # One batched query for all texts, returns a ranked list of hits per query
+    # Embeddings come back too, the context builder reuses them for MMR
+    # `where` is a Chroma metadata filter, e.g. {"doc_type": "api"}
+    result = collection.query(
+        **_query_args(queries, embedder),
+        include=["documents", "metadatas", "distances", "embeddings"],
+        n_results=n_results,
+        where=where or None
+    )
+    hits = []
+    for ids, docs, metas, distances, vectors in zip(
+        result["ids"], result["documents"], result["metadatas"], result["distances"], result["embeddings"]
+    ):
+        hits.append([
+            {"id": i, "document": d, "metadata": m or {}, "distance": dist, "embedding": v}
+            for i, d, m, dist, v in zip(ids, docs, metas, distances, vectors)
+        ])
+    return hits
+
+def reciprocal_rank_fusion(hit_lists, n_results=4, k=60, weights=None):
+
+    # Score each hit by sum(weight / (k + rank)) across the ranked lists it appears in,
+    # kept on the returned hits as "fused_score" (the reranker's relevance)
+    if weights is None:
+        weights = [1.0] * len(hit_lists)
+    scores, hits = {}, {}
+    for ranked, weight in zip(hit_lists, weights):
+        for rank, hit in enumerate(ranked):
+            scores[hit["id"]] = scores.get(hit["id"], 0.0) + weight / (k + rank + 1)
+            hits.setdefault(hit["id"], hit)
+    best = sorted(scores, key=scores.get, reverse=True)[:n_results]
+    return [{**hits[i], "fused_score": scores[i]} for i in best]
+
+@contextmanager
+def _no_span(name, **attributes):
+    yield attributes
+
+async def retrieve(collection, query, expand, expanded_prompt=None, n_results=4, parallel=True, skip_distance=None,
+                   span=None, embedder=None, where=None, min_filtered_hits=1):
+
+    # Returns the vector hit lists to fuse and the expanded prompt.
+    # `expand` is an async callable(query) -> expanded prompt, only called if no expansion is given.
+    # It is awaited on the event loop, only the searches (embedding, Chroma or NumPy) go to worker
+    # threads, so a chat waiting on the LLM doesn't hold a thread.
+    # `span` is an optional telemetry Trace.span used to time each collection query.
+    # `where` scopes the search; once a filtered search comes back with fewer than
+    # `min_filtered_hits` hits, this and later searches run unfiltered.
+    span = span or _no_span
+    scope = {"where": where}
+
+    def search_sync(texts):
+        with span("collection.query", queries=len(texts), filtered=bool(scope["where"])) as attributes:
+            hits = query_collection(collection, texts, n_results, embedder, scope["where"])
+            if scope["where"] and min(len(h) for h in hits) < min_filtered_hits:
+                scope["where"] = None
+                attributes["filtered"] = "fallback"
+                hits = query_collection(collection, texts, n_results, embedder)
+            return hits
+
+    async def search(texts):
+        return await asyncio.to_thread(search_sync, texts)
+
+    if expanded_prompt:
+        # Expansion already known (e.g. cached), search raw and expanded query in one batch.
+        # A cached "expansion" equal to the query comes from a skipped expansion, search it once.
+        if expanded_prompt == query:
+            return await search([query]), query
+        return await search([query, expanded_prompt]), expanded_prompt
+    if not parallel:
+        expanded_prompt = await expand(query)
+        return await search([expanded_prompt]), expanded_prompt
+
+    if skip_distance is not None:
+        # The raw hit is checked before the expansion call is made, so a confident match saves
+        # the LLM call itself, not just the wait; the expansion then starts a search later
+        raw_hits = (await search([query]))[0]
+        if raw_hits and raw_hits[0]["distance"] <= skip_distance:
+            return [raw_hits], query
+        expanded_prompt = await expand(query)
+        return [raw_hits] + await search([expanded_prompt]), expanded_prompt
+
+    # Run the expansion call in the background while searching with the raw query
+    expansion = asyncio.ensure_future(expand(query))
+    try:
+        raw_hits = (await search([query]))[0]
+    except BaseException:
+        expansion.cancel()
+        raise
+    expanded_prompt = await expansion
+    return [raw_hits] + await search([expanded_prompt]), expanded_prompt
+
+def classify_query(query):
+
+    # Cheap pre-classifier that routes a query to a subset of the docs, as a Chroma `where` filter.
+    # Returns None when nothing stands out, ambiguous queries search everything.
+    clauses = []
+    is_api, is_guide = bool(API_QUERY.search(query)), bool(GUIDE_QUERY.search(query))
+    if is_api != is_guide:
+        clauses.append({"doc_type": "api" if is_api else "guide"})
+    if CODE_QUERY.search(query):
+        clauses.append({"is_code": True})
+    version = VERSION_QUERY.search(query)
+    if version:
+        clauses.append({"version": version.group(1)})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def hybrid_fusion(vector_hits, lexical_hits, n_results=4, vector_weight=1.0, lexical_weight=1.0):
+    hit_lists = vector_hits + ([lexical_hits] if lexical_weight > 0 else [])
+    weights = [vector_weight] * len(vector_hits) + ([lexical_weight] if lexical_weight > 0 else [])
+    return reciprocal_rank_fusion(hit_lists, n_results, weights=weights)
+
+def build_plain_prompt(question):
+
+    return (
+        f"As a beginner-friendly coding assistant, answer the question concisely and shortly. Provide short, simple and easy to understand Python code. Prevent using custom functions. " 
+        f"For any code chunk, wrap it in triple backticks and specify the language after the opening backticks. For plain text, the triple backticks are not needed. \n\n"
+        f"Question: {question}\nAnswer:"
+    )
+
+def build_rag_prompt(question, docs):
+    
+    context = "\n\n".join(docs) if docs else ""
+    
+    return (
+        f"As a beginner-friendly coding assistant, use the following context to answer the question concisely and shortly. Provide short, simple and easy to understand Python code. Prevent using custom functions. "
+        f"For any code chunk, wrap it in triple backticks and specify the language after the opening backticks. For plain text, the triple backticks are not needed. \n\n"
+        f"Context:\n{context}\n\n"
+        f"Question: {question}\nAnswer:"
+    )
+
+########################################################
+# Context Assembly
+########################################################
+
+def _shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+def drop_near_duplicates(hits, threshold=0.8):
+
+    # Keeps the first of any passages whose word 3-gram Jaccard similarity is above threshold,
+    # e.g. the same section scraped from two versions of a page
+    kept, kept_shingles = [], []
+    for hit in hits:
+        shingles = _shingles(hit["document"])
+        if any(len(shingles & other) / max(len(shingles | other), 1) > threshold for other in kept_shingles):
+            continue
+        kept.append(hit)
+        kept_shingles.append(shingles)
+    return kept
+
+def _get_cross_encoder():
+    global _cross_encoder
+    with _cross_encoder_lock:
+        if _cross_encoder is None:
+            from sentence_transformers import CrossEncoder
+            _cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL, device="cpu")
+    return _cross_encoder
+
+def cross_encoder_rerank(query, hits):
+
+    # Needs the optional sentence-transformers package, keeps the fused order if it's missing
+    try:
+        scores = _get_cross_encoder().predict([(query, h["document"]) for h in hits])
+    except Exception as e:
+        logging.warning(f"Cross-encoder rerank unavailable: {e}")
+        return hits
+    return [h for _, h in sorted(zip(scores, hits), key=lambda x: x[0], reverse=True)]
+
+def mmr_rerank(query_vector, hits, embedder=None, mmr_lambda=0.7):
+
+    # Maximal marginal relevance: each pick trades relevance to the query against
+    # similarity to what is already picked. Vector hits carry their embedding,
+    # lexical-only hits are embedded here.
+    # Relevance is the fused score scaled to 0-1, so the fusion weights (and lexical and expansion
+    # hits) still count; hits without one fall back to cosine similarity to query_vector.
+    missing = [h["document"] for h in hits if h.get("embedding") is None]
+    if missing and embedder is None:
+        return hits
+    encoded = iter(embedder.embed_documents(missing) if missing else [])
+    vectors = np.array([
+        h["embedding"] if h.get("embedding") is not None else next(encoded) for h in hits
+    ], dtype=np.float32)
+    vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    if all("fused_score" in h for h in hits):
+        fused = np.array([h["fused_score"] for h in hits], dtype=np.float32)
+        spread = fused.max() - fused.min()
+        relevance = (fused - fused.min()) / spread if spread > 0 else np.ones(len(hits), dtype=np.float32)
+    else:
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        relevance = vectors @ (query_vector / max(np.linalg.norm(query_vector), 1e-12))
+    similarity = vectors @ vectors.T
+
+    selected, remaining = [], list(range(len(hits)))
+    while remaining:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+        selected.append(remaining.pop(int(np.argmax(scores))))
+    return [hits[i] for i in selected]
+
+def select_passages(query, hits, token_budget, max_passages=4, rerank="mmr", embedder=None, mmr_lambda=0.7,
+                    dedup_threshold=0.8):
+
+    # Candidates in fused order -> near-duplicates dropped -> reranked -> packed into the token budget.
+    # Passages that don't fit are skipped, so a long one doesn't crowd out shorter relevant ones.
+    hits = drop_near_duplicates(hits, dedup_threshold)
+    if rerank == "mmr" and embedder is not None and len(hits) > 1:
+        # Fused hits bring their own relevance, the query is only embedded for other hit lists
+        query_vector = None if all("fused_score" in h for h in hits) else embedder.embed_queries([query])[0]
+        hits = mmr_rerank(query_vector, hits, embedder, mmr_lambda)
+    elif rerank == "cross-encoder" and len(hits) > 1:
+        hits = cross_encoder_rerank(query, hits)
+
+    selected, used = [], 0
+    for hit in hits:
+        tokens = count_tokens(hit["document"]) + 2  # Separator between passages
+        if used + tokens > token_budget:
+            continue
+        selected.append(hit)
+        used += tokens
+        if len(selected) == max_passages:
+            break
+    return selected
+
+########################################################
+# History
+########################################################
+
+def trim_history(history, token_budget, summary_tokens=100):
+
+    # Keeps the most recent messages that fit in the budget, starting on a user turn.
+    # Older user questions are folded into one short note instead of being resent in full.
+    kept, used = [], 0
+    for message in reversed(history):
+        tokens = count_message_tokens([message])
+        if used + tokens > token_budget:
+            break
+        kept.insert(0, message)
+        used += tokens
+    while kept and kept[0]["role"] != "user":
+        used -= count_message_tokens([kept.pop(0)])
+
+    dropped = [" ".join(m["content"].split()[:20]) for m in history[:len(history) - len(kept)] if m["role"] == "user"]
+    while dropped:
+        note = "Earlier in this conversation the user asked: " + "; ".join(dropped)
+        if count_message_tokens([{"content": note}]) <= min(summary_tokens, token_budget - used):
+            kept.insert(0, {"role": "system", "content": note})
+            break
+        dropped.pop(0)
+    return kept
+
+########################################################
+# Warm Up
+########################################################
+
+def rss_mb():
+
+    # Current resident memory of this process (Linux), falls back to peak RSS elsewhere,
+    # None where neither is available (Windows has no resource module)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def warm_up_collections(get_collection, collection_names, embedder=None):
+
+    # Load each index with a throwaway query and record what it cost.
+    # The first entry also pays for loading the embedding model.
+    report = []
+    for name in collection_names:
+        rss_before, start = rss_mb(), time.perf_counter()
+        try:
+            collection = get_collection(name)
+            collection.query(**_query_args(["warm up"], embedder), n_results=1)
+        except Exception as e:
+            logging.warning(f"Could not warm up '{name}': {e}")
+            continue
+        report.append({
+            "collection": name,
+            "documents": collection.count(),
+            "load_ms": round((time.perf_counter() - start) * 1000, 1),
+            "memory_mb": round(rss_mb() - rss_before, 1) if rss_before is not None else None
+        })
+        logging.info(f"Warmed up {report[-1]}")
+    return report
@@ -1,27 +1,40 @@
+import time
 import yaml
 import logging
+import argparse
 import chromadb
 import asyncio
-from components import setup_collection, fetch_links, fetch_sitemap, scrape_page
+from components import setup_collection, fetch_links, fetch_sitemap, scrape_page, WorkerPool, MAX_REMOVED_FRACTION
+from aliases import promote_collection, prune_versions
+from lexical import open_index, drop_collection
+from exact import drop_export
+from checkpoint import open_checkpoint, reset_checkpoint, set_state, get_state, pending_links, progress
 
 ########################################################
 # Configuration
 ########################################################
 
-# Configure library name
-LIBRARY_NAME = input("Enter library to scrape: ")
-if not LIBRARY_NAME:
-    print("No input provided. Aborting.")
-    exit()
+parser = argparse.ArgumentParser(description="Scrape libraries from libraries.yaml into ./vectors")
+parser.add_argument("libraries", nargs="*", help="Libraries to scrape (prompted for when omitted)")
+parser.add_argument("--all", action="store_true", help="Scrape every library in libraries.yaml")
+# Configure run mode: full rebuild (default) or incremental update
+parser.add_argument("--incremental", action="store_true", help="Only re-embed pages that changed")
+# Continue an interrupted run from its checkpoint instead of starting over
+parser.add_argument("--resume", action="store_true", help="Continue interrupted runs from their checkpoints")
+parser.add_argument("--allow-removals", action="store_true",
+                    help="Let --incremental remove any number of pages that are gone from the site")
+parser.add_argument("--parallel", type=int, default=2, help="Libraries scraped at the same time")
+parser.add_argument("--browser-workers", type=int, default=3, help="Browser pages open at once, across all libraries")
+parser.add_argument("--http-workers", type=int, default=10, help="HTTP requests in flight, across all libraries")
+parser.add_argument("--per-host", type=int, default=4, help="Requests in flight to any one host")
+parser.add_argument("--rate-limit", type=float, default=2.0, help="Crawl requests per second to any one host")
+parser.add_argument("--embed-workers", type=int, default=1, help="Threads embedding and writing batches to Chroma")
+
+MAX_FAILURES = 5  # Links that failed this many times are no longer retried on resume
 
 # Configure basic information
 with open("./utils/libraries.yaml") as f:
     data = yaml.safe_load(f)
-library = data[LIBRARY_NAME]
-ROOT_URL = library.get("root_url", [])
-BASE_URL = library["base_url"]
-EXCLUDE_URL = library.get("exclude_url", [])
-TAG_TO_SCRAPE = library["tag_to_scrape"]
 
 # Configure ChromaDB client
 CLIENT = chromadb.PersistentClient(path="./vectors")
@@ -33,11 +46,43 @@ logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 # Main Execution
 ########################################################
 
-async def main():
-    setup_collection(
+async def ingest(LIBRARY_NAME, pool, incremental=False, resume=False, allow_removals=False):
+    library = data[LIBRARY_NAME]
+    ROOT_URL = library.get("root_url", [])
+    BASE_URL = library["base_url"]
+    EXCLUDE_URL = library.get("exclude_url", [])
+    RENDER_JS = library.get("render_js", False)
+    SITEMAP_FILE = library.get("sitemap_file")
+    MAX_DEPTH = library.get("max_depth")
+
+    checkpoint = open_checkpoint(LIBRARY_NAME)
+
+    if resume:
+        # Continue into the same collection with whatever is not scraped yet
+        collection_name = get_state(checkpoint, "collection_name")
+        if not collection_name:
+            raise ValueError(f"No checkpoint found for '{LIBRARY_NAME}', run without --resume first.")
+        if progress(checkpoint)["total"] == 0:
+            raise ValueError("The previous run stopped before its links were collected, run without --resume.")
+        incremental = get_state(checkpoint, "incremental") == "True"
+        all_links = pending_links(checkpoint, MAX_FAILURES)
+        logging.info(f"Resuming '{collection_name}': {progress(checkpoint)}, {len(all_links)} links to go")
+        checkpoint.close()
+        stats = await scrape_links(LIBRARY_NAME, library, all_links, collection_name, pool, incremental, resume)
+        return len(all_links), stats
+
+    # Link discovery failures are counted, incremental runs only remove pages after a clean discovery
+    discovery = {"failed": 0}
+    collection_name = setup_collection(
         CLIENT,
-        LIBRARY_NAME
+        LIBRARY_NAME,
+        incremental=incremental,
+        hnsw=library.get("hnsw")
     )
+    reset_checkpoint(checkpoint)
+    set_state(checkpoint, "collection_name", collection_name)
+    set_state(checkpoint, "incremental", incremental)
+    checkpoint.close()
 
     if not ROOT_URL:
         all_links = await fetch_links(
@@ -46,26 +91,130 @@ async def main():
             EXCLUDE_URL,
             max_links=None,
             concurrency=5,
-            sleep=1
+            sleep=1,
+            render_js=RENDER_JS,
+            max_depth=MAX_DEPTH,
+            respect_robots=True,
+            sitemap_path=SITEMAP_FILE,
+            pool=pool,
+            stats=discovery
         )
     else:
-        all_links = fetch_sitemap(
+        all_links = await fetch_sitemap(
             ROOT_URL,
             BASE_URL,
             LIBRARY_NAME,
-            EXCLUDE_URL
+            EXCLUDE_URL,
+            concurrency=8,
+            max_depth=3,
+            pool=pool,
+            stats=discovery
         )
     await asyncio.sleep(10)
-    await scrape_page(
+    stats = await scrape_links(
+        LIBRARY_NAME, library, all_links, collection_name, pool, incremental, resume,
+        links_complete=discovery["failed"] == 0, allow_removals=allow_removals
+    )
+    return len(all_links), stats
+
+async def scrape_links(LIBRARY_NAME, library, all_links, collection_name, pool, incremental, resume,
+                       links_complete=False, allow_removals=False):
+    stats = await scrape_page(
         all_links,
         CLIENT,
-        TAG_TO_SCRAPE,
+        library["tag_to_scrape"],
         LIBRARY_NAME,
         timeout=20000,
         concurrency=3,
-        sleep=3
+        sleep=3,
+        chunk_overlap=50,
+        batch_size=64,
+        batch_bytes=2_000_000,
+        flush_interval=5.0,
+        incremental=incremental,
+        collection_name=collection_name,
+        max_retries=2,
+        retry_backoff=2.0,
+        resume=resume,
+        render_js=library.get("render_js", False),
+        http_concurrency=10,
+        pool=pool,
+        links_complete=links_complete,
+        max_removed=1.0 if allow_removals else MAX_REMOVED_FRACTION
     )
 
+    # An exact search export of the collection is out of date now, the app exports it again
+    drop_export(collection_name)
+
+    # Swap the app over to the freshly built version, then drop older versions
+    if not incremental:
+        if CLIENT.get_collection(name=collection_name).count() == 0:
+            logging.warning(f"'{collection_name}' is empty, keeping the current live collection.")
+            return stats
+        promote_collection(LIBRARY_NAME, collection_name)
+        lexical = open_index()
+        for name in prune_versions(CLIENT, LIBRARY_NAME, keep=1):
+            drop_collection(lexical, name)
+            drop_export(name)
+        lexical.close()
+    return stats
+
+async def main(args, libraries):
+    # One pool for the whole run, libraries beyond --parallel wait for a free slot
+    slots = asyncio.Semaphore(args.parallel)
+    report = {}
+
+    async def run(LIBRARY_NAME):
+        async with slots:
+            logging.info(f"Starting '{LIBRARY_NAME}'...")
+            start = time.perf_counter()
+            try:
+                links, stats = await ingest(
+                    LIBRARY_NAME, pool, incremental=args.incremental, resume=args.resume, allow_removals=args.allow_removals
+                )
+                error = ""
+            except Exception as e:
+                logging.error(f"'{LIBRARY_NAME}' failed: {e}")
+                links, stats, error = 0, {}, str(e)
+            report[LIBRARY_NAME] = {"links": links, "seconds": time.perf_counter() - start, "error": error, **stats}
+
+    async with WorkerPool(
+        browser_concurrency=args.browser_workers,
+        http_concurrency=args.http_workers,
+        host_concurrency=args.per_host,
+        embed_workers=args.embed_workers,
+        rate_limit=args.rate_limit
+    ) as pool:
+        await asyncio.gather(*(run(name) for name in libraries))
+
+    print_report(report)
+
+def print_report(report):
+    logging.info("Summary:")
+    for LIBRARY_NAME, r in report.items():
+        if r["error"]:
+            logging.info(f"  {LIBRARY_NAME}: FAILED after {r['seconds']:.0f}s ({r['error']})")
+            continue
+        pages = r["added"] + r["updated"] + r["unchanged"]
+        logging.info(
+            f"  {LIBRARY_NAME}: {pages}/{r['links']} pages in {r['seconds']:.0f}s "
+            f"({pages / max(r['seconds'], 1e-9):.2f} pages/sec), failed: {r['failed']}, "
+            f"added: {r['added']}, updated: {r['updated']}, unchanged: {r['unchanged']}, removed: {r['removed']}"
+        )
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parser.parse_args()
+
+    # Configure library names
+    libraries = sorted(data) if args.all else args.libraries
+    if not libraries:
+        LIBRARY_NAME = input("Enter library to scrape: ")
+        if not LIBRARY_NAME:
+            print("No input provided. Aborting.")
+            exit()
+        libraries = [LIBRARY_NAME]
+    unknown = [name for name in libraries if name not in data]
+    if unknown:
+        parser.error(f"Unknown libraries: {', '.join(unknown)}")
 
+    asyncio.run(main(args, libraries))
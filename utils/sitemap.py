@@ -0,0 +1,168 @@
+import zlib
+import asyncio
+import logging
+from contextlib import nullcontext
+import xml.etree.ElementTree as ET
+from urllib.parse import urlsplit
+from crawler import normalize_url
+
+########################################################
+# Configuration
+########################################################
+
+GZIP_MAGIC = b"\x1f\x8b"
+MAX_INDEX_DEPTH = 3  # Sitemap indexes nested deeper than this are not followed
+
+########################################################
+# Parsing
+########################################################
+
+def _local(tag):
+    # "{http://www.sitemaps.org/schemas/sitemap/0.9}loc" -> "loc", also without a namespace
+    return tag.rsplit("}", 1)[-1]
+
+def _is_sitemap_link(loc):
+    # Some sites list their sub-sitemaps as <url> entries instead of a <sitemapindex>
+    path = urlsplit(loc).path.lower()
+    return path.endswith((".xml", ".xml.gz")) and "sitemap" in path
+
+class SitemapParser:
+
+    # Incremental parser fed with raw bytes as they arrive, gzip is detected from the first
+    # bytes and inflated on the fly. Only the entry being parsed is kept in memory.
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.root = None
+        self.inflate = None
+        self.started = False
+
+    def feed(self, data):
+        if not self.started:
+            self.started = True
+            if data.startswith(GZIP_MAGIC):
+                self.inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.inflate:
+            data = self.inflate.decompress(data)
+        self.parser.feed(data)
+        return self._entries()
+
+    def close(self):
+        if self.inflate:
+            self.parser.feed(self.inflate.flush())
+        self.parser.close()
+        return self._entries()
+
+    def _entries(self):
+        # ("page" | "sitemap", loc, lastmod) for every <url> or <sitemap> completed so far
+        entries = []
+        for event, element in self.parser.read_events():
+            if event == "start":
+                if self.root is None:
+                    self.root = element
+                continue
+            kind = _local(element.tag)
+            if kind not in ("url", "sitemap"):
+                continue
+            fields = {_local(child.tag): (child.text or "").strip() for child in element}
+            loc = fields.get("loc")
+            if loc:
+                if kind == "sitemap" or _is_sitemap_link(loc):
+                    entries.append(("sitemap", loc, fields.get("lastmod", "")))
+                else:
+                    entries.append(("page", loc, fields.get("lastmod", "")))
+            # Finished entries are dropped from the tree, so memory stays flat on big sitemaps
+            self.root.clear()
+        return entries
+
+########################################################
+# Fetching
+########################################################
+
+async def discover_sitemaps(http, root_url):
+
+    # <root_url>/sitemap.xml, plus any Sitemap: lines from robots.txt
+    root_url = root_url.rstrip("/")
+    found = [f"{root_url}/sitemap.xml"]
+    try:
+        response = await http.get(f"{root_url}/robots.txt")
+        if response.status_code == 200:
+            for line in response.text.splitlines():
+                key, _, value = line.partition(":")
+                if key.strip().lower() == "sitemap" and value.strip():
+                    found.append(value.strip())
+    except Exception as e:
+        logging.info(f"Could not read robots.txt for {root_url}: {e}")
+    return list(dict.fromkeys(found))
+
+async def stream_sitemap(http, sitemap_urls, include, exclude, concurrency=8, max_depth=MAX_INDEX_DEPTH, slot=None,
+                         stats=None):
+
+    # Yields (url, lastmod) for every page under `include` and not under `exclude` (PrefixTries over
+    # normalized URLs), as soon as it is parsed. Sub-sitemaps of indexes are fetched concurrently,
+    # `slot` is an optional callable(url) -> async context manager that limits requests (e.g. WorkerPool.http_slot).
+    # Counts (sitemaps read, failed, entries) go to `stats` when a dict is passed.
+    pending = asyncio.Queue()
+    results = asyncio.Queue()
+    seen_sitemaps, seen_pages = set(), set()
+    stats = stats if stats is not None else {}
+    stats.update({"sitemaps": 0, "entries": 0, "failed": 0})
+
+    def schedule(url, depth):
+        if url not in seen_sitemaps:
+            seen_sitemaps.add(url)
+            pending.put_nowait((url, depth))
+
+    async def read(url, depth):
+        parser = SitemapParser()
+        async with (slot(url) if slot else nullcontext()):
+            async with http.stream("GET", url) as response:
+                response.raise_for_status()
+                async for data in response.aiter_bytes():
+                    for entry in parser.feed(data):
+                        await handle(entry, depth)
+        for entry in parser.close():
+            await handle(entry, depth)
+        stats["sitemaps"] += 1
+
+    async def handle(entry, depth):
+        kind, loc, lastmod = entry
+        stats["entries"] += 1
+        if kind == "sitemap":
+            if depth < max_depth:
+                schedule(loc, depth + 1)
+            return
+        url = normalize_url(loc)
+        if url and url not in seen_pages and include.match(url) and not exclude.match(url):
+            seen_pages.add(url)
+            await results.put((url, lastmod))
+
+    async def worker():
+        while True:
+            url, depth = await pending.get()
+            try:
+                await read(url, depth)
+            except Exception as e:
+                stats["failed"] += 1
+                logging.warning(f"Could not read sitemap {url}: {e}")
+            finally:
+                pending.task_done()
+
+    async def finish():
+        await pending.join()
+        await results.put(None)
+
+    for url in sitemap_urls:
+        schedule(url, 0)
+    tasks = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    tasks.append(asyncio.create_task(finish()))
+    try:
+        while (item := await results.get()) is not None:
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logging.info(
+            f"Sitemaps read: {stats['sitemaps']}, failed: {stats['failed']}, "
+            f"entries: {stats['entries']}, pages kept: {len(seen_pages)}"
+        )
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tarfile
+import argparse
+import chromadb
+import numpy as np
+from exact import export_collection, stamp_export, EXACT_PATH
+from aliases import resolve_collection, promote_collection
+from lexical import open_index, add_documents
+from embeddings import get_embedder
+
+########################################################
+# Configuration
+########################################################
+
+VECTOR_PATH = "./vectors"
+SNAPSHOT_DIR = "./snapshots"
+SNAPSHOT_FORMAT = 1  # Bumped when the layout changes, older readers refuse newer snapshots
+SNAPSHOT_MANIFEST = "snapshot.json"
+IMPORT_BATCH = 1000
+
+# A snapshot is <collection>.snapshot.tar.gz (plus a sha256sum-style .sha256 file next to it) holding
+# snapshot.json (counts, settings and a checksum of the documents) and the collection's exact search
+# export (see exact.py): embeddings as one float32 .npy, records.jsonl with an offsets .npy for
+# documents and metadata. Imported, the export is memory-mapped as is and Chroma is rebuilt from the
+# stored embeddings, so nothing is re-embedded on the replica.
+
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+parser = argparse.ArgumentParser(description="Export a library's collection to a portable snapshot, or import one")
+commands = parser.add_subparsers(dest="command", required=True)
+export_parser = commands.add_parser("export", help="Pack the live collection of a library")
+export_parser.add_argument("--library", required=True)
+export_parser.add_argument("--output-dir", default=SNAPSHOT_DIR)
+import_parser = commands.add_parser("import", help="Load a snapshot into ./vectors and make it live")
+import_parser.add_argument("snapshot")
+import_parser.add_argument("--no-promote", action="store_true", help="Load without pointing the library at it")
+verify_parser = commands.add_parser("verify", help="Check a snapshot's checksums without importing it")
+verify_parser.add_argument("snapshot")
+
+########################################################
+# Utility Functions
+########################################################
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _records(path):
+    with open(os.path.join(path, "records.jsonl"), "rb") as f:
+        for line in f:
+            yield json.loads(line)
+
+def _content_checksum(records):
+    # Over (id, document, metadata) in id order, so a collection holding the same documents in any order matches
+    digests = sorted(
+        (i, hashlib.sha256(json.dumps([d, m or {}], sort_keys=True).encode("utf-8")).digest()) for i, d, m in records
+    )
+    digest = hashlib.sha256()
+    for i, record_digest in digests:
+        digest.update(i.encode("utf-8") + b"\0" + record_digest)
+    return digest.hexdigest()
+
+def _collection_records(collection):
+    for offset in range(0, collection.count(), IMPORT_BATCH):
+        page = collection.get(include=["documents", "metadatas"], limit=IMPORT_BATCH, offset=offset)
+        yield from zip(page["ids"], page["documents"], page["metadatas"])
+
+def _check_archive(snapshot_path):
+    # The whole archive against its .sha256, when one came with it
+    checksum_path = f"{snapshot_path}.sha256"
+    if not os.path.exists(checksum_path):
+        logging.warning(f"No {checksum_path}, only the files inside are verified")
+        return
+    with open(checksum_path) as f:
+        expected = f.read().split()[0]
+    if _sha256(snapshot_path) != expected:
+        raise ValueError(f"Checksum mismatch for {snapshot_path}")
+
+def _unpack(snapshot_path, target):
+
+    # Extracts only the files the manifest lists, and checks each one's sha256
+    with tarfile.open(snapshot_path, "r:gz") as archive:
+        manifest = json.load(archive.extractfile(SNAPSHOT_MANIFEST))
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format {manifest.get('format')}, this version reads {SNAPSHOT_FORMAT}")
+        os.makedirs(target, exist_ok=True)
+        for name, expected in manifest["files"].items():
+            if os.path.basename(name) != name:
+                raise ValueError(f"Unexpected file in snapshot: {name}")
+            with archive.extractfile(f"collection/{name}") as source, open(os.path.join(target, name), "wb") as f:
+                shutil.copyfileobj(source, f, 1 << 20)
+            if _sha256(os.path.join(target, name)) != expected:
+                raise ValueError(f"Checksum mismatch for {name} in {snapshot_path}")
+    return manifest
+
+########################################################
+# Export / Import
+########################################################
+
+def export_snapshot(CLIENT, library_name, output_dir=SNAPSHOT_DIR):
+    collection = CLIENT.get_collection(name=resolve_collection(library_name, VECTOR_PATH))
+    staging = os.path.join(output_dir, f".{collection.name}.export")
+    shutil.rmtree(staging, ignore_errors=True)
+
+    # float32 so the replica can memory-map it, compression is left to the archive
+    export_collection(collection, "float32", staging)
+    export_dir = os.path.join(staging, collection.name)
+    files = sorted(os.listdir(export_dir))
+    hnsw = {k: v for k, v in ((collection.configuration or {}).get("hnsw") or {}).items() if v is not None}
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "library": library_name,
+        "collection": collection.name,
+        "documents": collection.count(),
+        "metadata": collection.metadata or {},
+        "hnsw": hnsw,
+        "content": _content_checksum((r["id"], r["document"], r["metadata"]) for r in _records(export_dir)),
+        "created": time.time(),
+        "files": {name: _sha256(os.path.join(export_dir, name)) for name in files}
+    }
+    with open(os.path.join(staging, SNAPSHOT_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    snapshot_path = os.path.join(output_dir, f"{collection.name}.snapshot.tar.gz")
+    with tarfile.open(f"{snapshot_path}.tmp", "w:gz", compresslevel=6) as archive:
+        archive.add(os.path.join(staging, SNAPSHOT_MANIFEST), arcname=SNAPSHOT_MANIFEST)
+        for name in files:
+            archive.add(os.path.join(export_dir, name), arcname=f"collection/{name}")
+    os.replace(f"{snapshot_path}.tmp", snapshot_path)
+    with open(f"{snapshot_path}.sha256", "w") as f:
+        f.write(f"{_sha256(snapshot_path)}  {os.path.basename(snapshot_path)}\n")
+    shutil.rmtree(staging)
+    logging.info(f"Exported '{collection.name}' ({manifest['documents']} documents) to {snapshot_path}")
+    return snapshot_path
+
+def verify_snapshot(snapshot_path, target):
+    _check_archive(snapshot_path)
+    return _unpack(snapshot_path, target)
+
+def import_snapshot(CLIENT, snapshot_path, promote=True):
+
+    # Unpacked next to the exact search exports (same filesystem, so the final move is a rename)
+    staging = os.path.join(EXACT_PATH, f".import-{os.getpid()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        manifest = verify_snapshot(snapshot_path, staging)
+        name, library_name = manifest["collection"], manifest["library"]
+
+        # Query vectors come from the local embedder, a snapshot made with another model can't be searched
+        embedding = manifest["metadata"].get("embedding")
+        if embedding and embedding != get_embedder().name:
+            raise ValueError(f"'{name}' was embedded with {embedding}, this replica uses {get_embedder().name}")
+
+        # A collection of the same name is only reused when it holds exactly the snapshot's documents,
+        # its export is replaced by the snapshot's and marked current below
+        existing = [c.name for c in CLIENT.list_collections()]
+        if name in existing:
+            content = manifest.get("content")
+            if not content:
+                raise FileExistsError(f"'{name}' already exists and this snapshot has no checksum to compare, delete it with monitor.py first")
+            if _content_checksum(_collection_records(CLIENT.get_collection(name=name))) != content:
+                raise FileExistsError(f"'{name}' already exists with different contents, delete it with monitor.py first")
+        if name not in existing:
+            collection = CLIENT.create_collection(
+                name=name,
+                metadata=manifest["metadata"] or None,
+                configuration={"hnsw": manifest["hnsw"]} if manifest["hnsw"] else None
+            )
+            vectors = np.load(os.path.join(staging, "embeddings.float32.npy"), mmap_mode="r")
+            lexical = open_index()
+            batch = []
+            for row, record in enumerate(_records(staging)):
+                batch.append(record)
+                if len(batch) == IMPORT_BATCH or row == len(vectors) - 1:
+                    ids = [r["id"] for r in batch]
+                    documents = [r["document"] for r in batch]
+                    metadatas = [r["metadata"] or None for r in batch]
+                    collection.add(
+                        ids=ids,
+                        embeddings=np.asarray(vectors[row + 1 - len(batch):row + 1]),
+                        documents=documents,
+                        metadatas=metadatas
+                    )
+                    add_documents(lexical, name, ids, documents, metadatas, fresh=True)
+                    batch = []
+            lexical.close()
+            logging.info(f"Loaded {collection.count()} documents into '{name}'")
+
+        # The unpacked files are the collection's exact search export, ready to be memory-mapped
+        target = os.path.join(EXACT_PATH, name)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(staging, target)
+        stamp_export(CLIENT.get_collection(name=name))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    if promote:
+        promote_collection(library_name, name)
+    return manifest
+
+########################################################
+# Main Execution
+########################################################
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    start = time.perf_counter()
+
+    if args.command == "verify":
+        staging = os.path.join(SNAPSHOT_DIR, f".verify-{os.getpid()}")
+        try:
+            manifest = verify_snapshot(args.snapshot, staging)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        print(f"{args.snapshot} is intact: '{manifest['collection']}' ({manifest['library']}), {manifest['documents']} documents")
+        exit()
+
+    CLIENT = chromadb.PersistentClient(path=VECTOR_PATH)
+    if args.command == "export":
+        os.makedirs(args.output_dir, exist_ok=True)
+        export_snapshot(CLIENT, args.library, args.output_dir)
+    else:
+        import_snapshot(CLIENT, args.snapshot, promote=not args.no_promote)
+    logging.info(f"Done in {time.perf_counter() - start:.1f}s")
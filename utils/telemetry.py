@@ -0,0 +1,174 @@
+import os
+import json
+import math
+import time
+import uuid
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+########################################################
+# Configuration
+########################################################
+
+TELEMETRY_PATH = "./logging/telemetry.jsonl"
+
+# OpenTelemetry export is switched on by the standard OTLP endpoint variable
+OTEL_ENABLED = bool(os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"))
+
+_write_lock = threading.Lock()
+_tracer = None
+
+########################################################
+# Tracing
+########################################################
+
+class Trace:
+
+    # Timing spans for one chat request. Spans are plain dicts so they can be
+    # recorded from worker threads, and are written out as one JSON line on finish().
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.attributes = attributes
+        self.spans = []
+        self.start = time.time()
+        self._perf_start = time.perf_counter()
+
+    def _now_ms(self):
+        return (time.perf_counter() - self._perf_start) * 1000
+
+    @contextmanager
+    def span(self, name, **attributes):
+        # Yields the attribute dict so callers can add token counts, cache status, etc.
+        start = self._now_ms()
+        try:
+            yield attributes
+        finally:
+            self.add_span(name, start, self._now_ms(), **attributes)
+
+    def add_span(self, name, start_ms, end_ms, **attributes):
+        self.spans.append({
+            "name": name,
+            "start_ms": round(start_ms, 2),
+            "duration_ms": round(end_ms - start_ms, 2),
+            **attributes
+        })
+
+    def mark(self):
+        return self._now_ms()
+
+    def finish(self, path=None, **attributes):
+        # Resolved at call time, so a load test can send its traces elsewhere
+        path = path or TELEMETRY_PATH
+        self.attributes.update(attributes)
+        record = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "timestamp": str(datetime.fromtimestamp(self.start)),
+            "duration_ms": round(self._now_ms(), 2),
+            **self.attributes,
+            "spans": self.spans
+        }
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with _write_lock, open(path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logging.warning(f"Could not write telemetry: {e}")
+        if OTEL_ENABLED:
+            _export_otel(record, self.start)
+        return record
+
+def _get_tracer():
+
+    # Set up the OTLP exporter once per process
+    global _tracer
+    if _tracer is None:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        provider = TracerProvider(resource=Resource.create({"service.name": "docsreader"}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+        _tracer = trace.get_tracer("docsreader")
+    return _tracer
+
+def _export_otel(record, start):
+
+    # Spans are replayed with explicit timestamps, which keeps parenting correct
+    # for spans that were recorded on worker threads
+    try:
+        from opentelemetry import trace
+        tracer = _get_tracer()
+        start_ns = int(start * 1e9)
+        attributes = {k: v for k, v in record.items() if isinstance(v, (str, bool, int, float)) and k != "name"}
+        root = tracer.start_span(record["name"], start_time=start_ns, attributes=attributes)
+        parent = trace.set_span_in_context(root)
+        for span in record["spans"]:
+            span_start = start_ns + int(span["start_ms"] * 1e6)
+            attributes = {k: v for k, v in span.items() if isinstance(v, (str, bool, int, float)) and k != "name"}
+            child = tracer.start_span(span["name"], context=parent, start_time=span_start, attributes=attributes)
+            child.end(end_time=span_start + int(span["duration_ms"] * 1e6))
+        root.end(end_time=start_ns + int(record["duration_ms"] * 1e6))
+    except Exception as e:
+        logging.warning(f"Could not export OpenTelemetry trace: {e}")
+
+########################################################
+# Aggregation
+########################################################
+
+def percentile(values, q):
+
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = math.ceil(q / 100 * len(ordered))
+    return ordered[max(rank, 1) - 1]
+
+def load_traces(path=TELEMETRY_PATH, since=None):
+    traces = []
+    if not os.path.exists(path):
+        return traces
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if since is None or record["timestamp"] >= since:
+                traces.append(record)
+    return traces
+
+def summarize(traces):
+
+    # Per-span latency percentiles plus request-level totals
+    durations, tokens = {}, {}
+    for record in traces:
+        durations.setdefault("request", []).append(record["duration_ms"])
+        for span in record["spans"]:
+            durations.setdefault(span["name"], []).append(span["duration_ms"])
+            for key in ("prompt_tokens", "completion_tokens"):
+                if key in span:
+                    tokens.setdefault(f"{span['name']}.{key}", []).append(span[key])
+
+    cache = [r.get("cache") for r in traces if r.get("cache")]
+    return {
+        "requests": len(traces),
+        "cache_hit_rate": round(cache.count("hit") / len(cache), 3) if cache else None,
+        "spans": {
+            name: {
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values), 1),
+                "p50_ms": round(percentile(values, 50), 1),
+                "p95_ms": round(percentile(values, 95), 1),
+                "p99_ms": round(percentile(values, 99), 1)
+            }
+            for name, values in durations.items()
+        },
+        "tokens": {name: round(sum(values) / len(values), 1) for name, values in tokens.items()}
+    }